@@ -0,0 +1,81 @@
+# scripts/benchmark_image_processing.py
+import argparse
+import hashlib
+import logging
+import tempfile
+import time
+from pathlib import Path
+from thesis_pipeline.components.processing import ImageProcessor
+
+# ==============================================================================
+# Stage 03 Benchmark: Images/sec vs. Worker Count
+# ==============================================================================
+# Runs ImageProcessor over the same input directory with different worker counts,
+# reports throughput, and checks that every run produces byte-identical outputs
+# to the serial (1 worker) run.
+
+logger = logging.getLogger("benchmark_image_processing")
+
+
+def _hash_outputs(output_dir: Path) -> dict:
+    return {p.name: hashlib.sha1(p.read_bytes()).hexdigest() for p in sorted(output_dir.iterdir())}
+
+
+def run_benchmark(input_dir: Path, worker_counts: list, image_size: tuple, output_format: str, chunk_size: int,
+                  fast_decode: bool) -> list:
+    results = []
+    reference_hashes = None
+
+    for num_workers in worker_counts:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            processor = ImageProcessor(
+                input_dir=input_dir,
+                output_dir=Path(tmp_dir),
+                image_size=image_size,
+                output_format=output_format,
+                num_workers=num_workers,
+                chunk_size=chunk_size,
+                fast_decode=fast_decode
+            )
+            start = time.perf_counter()
+            summary = processor.process_images()
+            elapsed = time.perf_counter() - start
+
+            output_hashes = _hash_outputs(Path(tmp_dir))
+            if reference_hashes is None:
+                reference_hashes = output_hashes
+            identical = output_hashes == reference_hashes
+
+        images_per_sec = summary["processed_count"] / elapsed if elapsed > 0 else 0.0
+        results.append({
+            "num_workers": processor.num_workers,
+            "processed": summary["processed_count"],
+            "seconds": elapsed,
+            "images_per_sec": images_per_sec,
+            "identical_to_first_run": identical
+        })
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark ImageProcessor throughput against worker count.")
+    parser.add_argument("--input-dir", default="data/01_raw/wikimedia_collection", help="Directory of raw images.")
+    parser.add_argument("--workers", nargs='+', type=int, default=[1, 2, 4, 8], help="Worker counts to benchmark; the first run is the reference.")
+    parser.add_argument("--image-size", nargs=2, type=int, default=[512, 512])
+    parser.add_argument("--format", default="PNG")
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--fast-decode", action="store_true", help="Decode large images at reduced scale before resizing.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)-8s | %(message)s")
+    logging.getLogger("thesis_pipeline").setLevel(logging.WARNING)
+
+    benchmark_results = run_benchmark(Path(args.input_dir), args.workers, tuple(args.image_size), args.format, args.chunk_size, args.fast_decode)
+
+    logger.info(f"{'workers':>8} | {'images':>7} | {'seconds':>8} | {'images/sec':>10} | identical")
+    for row in benchmark_results:
+        logger.info(
+            f"{row['num_workers']:>8} | {row['processed']:>7} | {row['seconds']:>8.2f} | "
+            f"{row['images_per_sec']:>10.1f} | {row['identical_to_first_run']}"
+        )
@@ -0,0 +1,65 @@
+# scripts/benchmark_mask_strategies.py
+import argparse
+import logging
+import time
+import numpy as np
+from thesis_pipeline.components.mask_strategies import MASK_STRATEGIES, generate_masks
+
+# ==============================================================================
+# Stage 05 Benchmark: Masks/sec per Mask Strategy
+# ==============================================================================
+# Generates a large number of masks with every registered strategy and reports
+# throughput and the mean masked fraction. Masks are produced in batches and
+# discarded, so memory stays bounded by the batch size.
+
+logger = logging.getLogger("benchmark_mask_strategies")
+
+
+def run_benchmark(strategies: list, num_masks: int, image_size: tuple, batch_size: int, mask_config: dict,
+                  seed: int) -> list:
+    results = []
+    height, width = image_size
+    for strategy_name in strategies:
+        rng = np.random.default_rng(seed)
+        masked_pixels = 0
+        start = time.perf_counter()
+        for batch_start in range(0, num_masks, batch_size):
+            count = min(batch_size, num_masks - batch_start)
+            masks = generate_masks(strategy_name, rng, count, height, width, mask_config, batch_size=batch_size)
+            masked_pixels += np.count_nonzero(masks)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "strategy": strategy_name,
+            "masks": num_masks,
+            "seconds": elapsed,
+            "masks_per_sec": num_masks / elapsed if elapsed > 0 else 0.0,
+            "mean_coverage": masked_pixels / (num_masks * height * width)
+        })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark batched mask generation for every mask strategy.")
+    parser.add_argument("--strategies", nargs='+', default=sorted(MASK_STRATEGIES), choices=sorted(MASK_STRATEGIES))
+    parser.add_argument("--num-masks", type=int, default=1_000_000)
+    parser.add_argument("--image-size", nargs=2, type=int, default=[64, 64], help="Mask height and width.")
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--min-ratio", type=float, default=0.1, help="min_mask_size_ratio")
+    parser.add_argument("--max-ratio", type=float, default=0.4, help="max_mask_size_ratio")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)-8s | %(message)s")
+
+    mask_config = {"min_mask_size_ratio": args.min_ratio, "max_mask_size_ratio": args.max_ratio}
+    benchmark_results = run_benchmark(
+        args.strategies, args.num_masks, tuple(args.image_size), args.batch_size, mask_config, args.seed
+    )
+
+    logger.info(f"{'strategy':>16} | {'masks':>9} | {'seconds':>8} | {'masks/sec':>10} | coverage")
+    for row in benchmark_results:
+        logger.info(
+            f"{row['strategy']:>16} | {row['masks']:>9} | {row['seconds']:>8.2f} | "
+            f"{row['masks_per_sec']:>10.0f} | {row['mean_coverage']:.3f}"
+        )
@@ -0,0 +1,58 @@
+# src/thesis_pipeline/components/comparison_writer.py
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+# format name -> (PIL format, file extension)
+COMPARISON_FORMATS = {"png": ("PNG", ".png"), "jpeg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+
+
+class ComparisonImageWriter:
+    """
+    Composes and saves (original | masked | restored) comparison images on a background thread
+    pool, so encoding and disk writes never stall the evaluation loop. At most `max_pending`
+    images are queued; `submit` blocks beyond that to bound memory. `close` waits for every write.
+    """
+    def __init__(self, output_dir: Path, image_format: str = "png", quality: int = 90,
+                 thumbnail_size: int = None, num_workers: int = 2, max_pending: int = 64):
+        if image_format not in COMPARISON_FORMATS:
+            raise ValueError(f"Unknown comparison image format: {image_format}. Available: {sorted(COMPARISON_FORMATS)}")
+        self.output_dir = Path(output_dir)
+        self.pil_format, self.extension = COMPARISON_FORMATS[image_format]
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self.executor = ThreadPoolExecutor(max_workers=max(1, num_workers))
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        self.logger = logging.getLogger(__name__)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+    def submit(self, name: str, original: np.ndarray, masked: np.ndarray, restored: np.ndarray):
+        """Queues the comparison of one sample; the (H, W, 3) uint8 arrays must not be modified afterwards."""
+        self.slots.acquire()
+        future = self.executor.submit(self._write, name, original, masked, restored)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def _write(self, name: str, original: np.ndarray, masked: np.ndarray, restored: np.ndarray):
+        comparison = Image.fromarray(np.concatenate([original, masked, restored], axis=1))
+        if self.thumbnail_size is not None:
+            # Each panel is shrunk to at most thumbnail_size pixels high, keeping the aspect ratio.
+            comparison.thumbnail((3 * comparison.width, self.thumbnail_size))
+        save_kwargs = {} if self.pil_format == "PNG" else {"quality": self.quality}
+        comparison.save(self.output_dir / f"compare_{Path(name).stem}{self.extension}", self.pil_format, **save_kwargs)
+
+    def close(self) -> int:
+        """Waits for all pending writes and shuts the pool down. Returns the number of failed writes."""
+        failed = 0
+        for future in self.futures:
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                self.logger.error(f"Failed to write a comparison image. Error: {error}")
+        self.futures = []
+        self.executor.shutdown(wait=True)
+        return failed
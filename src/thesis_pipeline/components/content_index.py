@@ -0,0 +1,140 @@
+# src/thesis_pipeline/components/content_index.py
+import hashlib
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from tqdm import tqdm
+from thesis_pipeline.utils.common import PersistentRecordStore
+
+PERCEPTUAL_HASH_BITS = 64
+INDEXED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff']
+
+
+def compute_sha1(path: Path) -> str:
+    """Computes the SHA-1 of a file; identical to the `sha1` reported by the MediaWiki API."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_perceptual_hash(path: Path) -> str:
+    """
+    Computes a 64-bit difference hash (dHash): the image is reduced to 9x8 grayscale and
+    each bit records whether a pixel is brighter than its right-hand neighbour.
+    Resized, re-encoded or lightly edited copies of an image end up a few bits apart.
+    """
+    with Image.open(path) as img:
+        img.draft("L", (64, 64))  # JPEGs are decoded at reduced scale; a no-op for other formats
+        pixels = np.asarray(img.convert("L").resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    # Row-major bits, most significant first
+    bits = (pixels[:, :-1] > pixels[:, 1:]).ravel()
+    return f"{int.from_bytes(np.packbits(bits).tobytes(), 'big'):016x}"
+
+
+class ContentIndex(PersistentRecordStore):
+    """
+    Content-addressed index of the raw image corpus, stored next to the images.
+    Maps each filename to the SHA-1 of its bytes and a perceptual hash of its pixels, so that
+    exact duplicates can be skipped at download time and near-duplicates flagged before splitting.
+    """
+    def __init__(self, path: Path):
+        super().__init__(path, flush_every=100)
+        self.logger = logging.getLogger(__name__)
+        self._claim_lock = threading.Lock()
+        self._filename_by_sha1 = {entry["sha1"]: filename for filename, entry in self.entries.items()}
+        self._claimed_names = set() # Filenames reserved by downloads still in progress
+
+    @staticmethod
+    def disambiguated_name(filename: str, sha1: str) -> str:
+        """The name a file is stored under when `filename` is already taken by different content."""
+        return f"{Path(filename).stem}_{sha1[:8]}{Path(filename).suffix}"
+
+    def claim(self, sha1: str, filename: str) -> tuple:
+        """
+        Atomically reserves `sha1` together with the filename it will be stored under: `filename`,
+        or its disambiguated name if another file already has or is being downloaded to it.
+        Returns (holder, reserved name): the filename that already holds (or is being downloaded
+        with) this content and None, or None and the reserved filename if the claim succeeded.
+        """
+        with self._claim_lock:
+            existing = self._filename_by_sha1.get(sha1)
+            if existing is not None:
+                return existing, None
+            if filename in self.entries or filename in self._claimed_names:
+                filename = self.disambiguated_name(filename, sha1)
+            self._filename_by_sha1[sha1] = filename
+            self._claimed_names.add(filename)
+            return None, filename
+
+    def release(self, sha1: str, filename: str):
+        """Drops a claim whose download failed."""
+        with self._claim_lock:
+            self._claimed_names.discard(filename)
+            if self._filename_by_sha1.get(sha1) == filename and self.get(filename) is None:
+                del self._filename_by_sha1[sha1]
+
+    def add(self, filename: str, file_path: Path, sha1: str = None):
+        """Indexes a file on disk. The SHA-1 is computed locally unless supplied (e.g. by the API)."""
+        sha1 = sha1 or compute_sha1(file_path)
+        entry = {"sha1": sha1, "phash": compute_perceptual_hash(file_path), "size": file_path.stat().st_size}
+        self.set(filename, entry)
+        with self._claim_lock:
+            self._filename_by_sha1.setdefault(sha1, filename)
+            self._claimed_names.discard(filename)
+
+    def update_from_directory(self, image_dir: Path, extensions: list):
+        """Indexes any image in `image_dir` that is not yet in the index and forgets deleted files."""
+        on_disk = {p.name: p for p in image_dir.iterdir() if p.is_file() and p.suffix.lower() in extensions}
+
+        for filename in [name for name in self.entries if name not in on_disk]:
+            del self.entries[filename]
+        self._filename_by_sha1 = {entry["sha1"]: filename for filename, entry in self.entries.items()}
+
+        unindexed = [path for name, path in on_disk.items() if name not in self.entries]
+        if unindexed:
+            self.logger.info(f"Indexing {len(unindexed)} images not yet in the content index...")
+        for path in tqdm(unindexed, desc="Indexing Images", disable=not unindexed):
+            try:
+                self.add(path.name, path)
+            except Exception as e:
+                self.logger.warning(f"Could not index {path}. Error: {e}")
+        self.flush()
+
+    def find_near_duplicates(self, max_distance: int) -> list:
+        """
+        Groups files whose perceptual hashes differ by at most `max_distance` bits.
+        Hashes are split into `max_distance + 1` bands; by the pigeonhole principle any two hashes
+        within the distance agree on at least one band, so only files sharing a band are compared.
+        Returns a list of groups (sorted lists of filenames), each with at least two members.
+        """
+        filenames = sorted(self.entries)
+        hashes = [int(self.entries[name]["phash"], 16) for name in filenames]
+        parent = list(range(len(filenames)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        num_bands = max_distance + 1
+        band_bits = -(-PERCEPTUAL_HASH_BITS // num_bands)
+        band_mask = (1 << band_bits) - 1
+        for band in range(num_bands):
+            buckets = {}
+            for i, hash_value in enumerate(hashes):
+                buckets.setdefault((hash_value >> (band * band_bits)) & band_mask, []).append(i)
+            for members in buckets.values():
+                for a_pos, a in enumerate(members):
+                    for b in members[a_pos + 1:]:
+                        if find(a) != find(b) and bin(hashes[a] ^ hashes[b]).count("1") <= max_distance:
+                            parent[find(a)] = find(b)
+
+        groups = {}
+        for i, filename in enumerate(filenames):
+            groups.setdefault(find(i), []).append(filename)
+        return sorted((group for group in groups.values() if len(group) > 1), key=lambda g: g[0])
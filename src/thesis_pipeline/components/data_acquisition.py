@@ -1,102 +1,363 @@
 # src/thesis_pipeline/components/data_acquisition.py
-import requests
+import os
+import time
+import random
+import itertools
 import logging
+import threading
+import requests
 from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from tqdm import tqdm
+from thesis_pipeline.utils.common import PersistentRecordStore
+from thesis_pipeline.components.content_index import ContentIndex, INDEXED_EXTENSIONS
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+IMAGEINFO_BATCH_SIZE = 50  # Maximum number of titles the MediaWiki API accepts per query
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests so that no single host receives more than
+    `requests_per_second` requests, regardless of how many threads are issuing them.
+    """
+    def __init__(self, requests_per_second: float):
+        self.min_interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        """Blocks until the host of `url` may receive another request."""
+        if self.min_interval == 0.0:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DownloadManifest(PersistentRecordStore):
+    """
+    Persistent record of the outcome for every image title.
+    Allows an interrupted acquisition run to resume without re-querying files it already has.
+    """
+    def is_complete(self, image_title: str, output_dir: Path) -> bool:
+        """True if the title was already handled and does not need another request."""
+        entry = self.get(image_title)
+        if entry is None:
+            return False
+        if entry["status"] in ("downloaded", "duplicate"):
+            return (output_dir / entry["filename"]).exists()
+        return entry["status"] == "missing"
+
+    def record(self, image_title: str, status: str, **details):
+        self.set(image_title, {"status": status, **details})
+
 
 class DataAcquisition:
-    def __init__(self, api_url: str):
+    def __init__(self, api_url: str, max_workers: int = 8, requests_per_second: float = 5.0,
+                 max_retries: int = 5, backoff_factor: float = 1.0, timeout: float = 30.0):
         self.api_url = api_url
-        self.session = requests.Session()
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self._thread_local = threading.local()
         self.logger = logging.getLogger(__name__)
 
-    def _get_images_in_category_recursive(self, category: str, visited_categories: set):
-        """Recursively fetches image file information from a Wikimedia category."""
-        if category in visited_categories:
-            return []
-        visited_categories.add(category)
-        
-        images = []
+    def _get_session(self) -> requests.Session:
+        """Returns a session owned by the calling thread; sessions are not safe to share."""
+        session = getattr(self._thread_local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._thread_local.session = session
+        return session
+
+    def _get_with_retry(self, url: str, **kwargs) -> requests.Response:
+        """
+        Issues a rate-limited GET request, retrying connection errors and
+        429/5xx responses with exponential backoff.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait(url)
+            retry_after = None
+            try:
+                response = self._get_session().get(url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                error = requests.HTTPError(f"{response.status_code} response from {url}", response=response)
+                response.close()
+
+            if attempt == self.max_retries:
+                raise error
+
+            delay = self.backoff_factor * (2 ** attempt) + random.uniform(0, self.backoff_factor)
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            self.logger.warning(f"Request to {url} failed ({error}). Retry {attempt + 1}/{self.max_retries} in {delay:.1f}s.")
+            time.sleep(delay)
+
+    def _fetch_category_page(self, category: str, continue_params: dict) -> tuple:
+        """
+        Fetches one page of members of a category.
+        Returns (file titles, subcategory titles, continuation params or None when exhausted).
+        """
         params = {
             "action": "query",
             "format": "json",
             "list": "categorymembers",
             "cmtitle": category,
-            "cmlimit": "500",
-            "cmtype": "file|subcat"
+            "cmlimit": "max",
+            "cmtype": "file|subcat",
+            **continue_params
         }
-        
+        response = self._get_with_retry(self.api_url, params=params)
+        data = response.json()
+
+        file_titles, subcategories = [], []
+        for member in data.get("query", {}).get("categorymembers", []):
+            if member["ns"] == 6:  # Namespace 6 is for files
+                file_titles.append(member["title"])
+            elif member["ns"] == 14:  # Namespace 14 is for subcategories
+                subcategories.append(member["title"])
+        return file_titles, subcategories, data.get("continue")
+
+    def iter_category_images(self, start_category: str):
+        """
+        Breadth-first crawl of a category tree that yields unique file titles as soon as they are found.
+        Every page request is a separate task, so continuation tokens are followed and several
+        subcategories are fetched concurrently without recursion.
+        """
+        visited_categories = {start_category}
+        seen_titles = set()
+        pages_fetched = 0
+        start_time = time.monotonic()
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        in_flight = {executor.submit(self._fetch_category_page, start_category, {}): start_category}
         try:
-            response = self.session.get(url=self.api_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            members = data.get("query", {}).get("categorymembers", [])
-            
-            for member in members:
-                if member["ns"] == 6:  # Namespace 6 is for files
-                    images.append(member["title"])
-                elif member["ns"] == 14:  # Namespace 14 is for subcategories
-                    images.extend(self._get_images_in_category_recursive(member["title"], visited_categories))
-
-        except requests.RequestException as e:
-            self.logger.error(f"Failed to fetch category {category}: {e}")
-
-        return images
-
-    def _download_image(self, image_title: str, output_dir: Path):
-        """Downloads a single image."""
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    category = in_flight.pop(future)
+                    try:
+                        file_titles, subcategories, continue_params = future.result()
+                    except (requests.RequestException, ValueError) as e:
+                        self.logger.error(f"Failed to fetch category {category}: {e}")
+                        continue
+
+                    pages_fetched += 1
+                    if continue_params:
+                        in_flight[executor.submit(self._fetch_category_page, category, continue_params)] = category
+                    for subcategory in subcategories:
+                        if subcategory not in visited_categories:
+                            visited_categories.add(subcategory)
+                            in_flight[executor.submit(self._fetch_category_page, subcategory, {})] = subcategory
+
+                    for title in file_titles:
+                        if title not in seen_titles:
+                            seen_titles.add(title)
+                            yield title
+
+                    if pages_fetched % 50 == 0:
+                        self._log_crawl_throughput(len(visited_categories), pages_fetched, len(seen_titles), start_time)
+        finally:
+            # Stops pending page requests if the consumer stopped early (e.g. the download limit was reached).
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._log_crawl_throughput(len(visited_categories), pages_fetched, len(seen_titles), start_time)
+
+    def _log_crawl_throughput(self, category_count: int, page_count: int, title_count: int, start_time: float):
+        elapsed = max(time.monotonic() - start_time, 1e-9)
+        self.logger.info(
+            f"Crawl: {category_count} categories, {page_count} pages, {title_count} unique files "
+            f"in {elapsed:.1f}s ({page_count / elapsed:.1f} pages/s, {title_count / elapsed:.1f} files/s)"
+        )
+
+    def _query_image_info_batch(self, image_titles: list) -> dict:
+        """
+        Resolves up to IMAGEINFO_BATCH_SIZE titles with a single imageinfo query.
+        Returns a mapping of title -> {url, size, sha1}, or None for titles without a file.
+        """
         params = {
             "action": "query",
             "format": "json",
-            "titles": image_title,
+            "titles": "|".join(image_titles),
             "prop": "imageinfo",
-            "iiprop": "url"
+            "iiprop": "url|size|sha1"
         }
+        response = self._get_with_retry(self.api_url, params=params)
+        query = response.json().get("query", {})
+
+        # The API answers with normalized titles (e.g. underscores -> spaces); map them back.
+        normalized = {item["to"]: item["from"] for item in query.get("normalized", [])}
+        resolved = {title: None for title in image_titles}
+        for page in query.get("pages", {}).values():
+            title = normalized.get(page.get("title"), page.get("title"))
+            if title in resolved and "imageinfo" in page:
+                info = page["imageinfo"][0]
+                resolved[title] = {"url": info["url"], "size": info.get("size"), "sha1": info.get("sha1")}
+        return resolved
+
+    def iter_resolved_images(self, image_titles, cache: PersistentRecordStore):
+        """
+        Yields (title, image info) pairs, resolving file URL, size and SHA-1 in batches of
+        IMAGEINFO_BATCH_SIZE titles. Titles already present in the on-disk cache are not queried again.
+        """
+        batch = []
+        for image_title in image_titles:
+            cached_info = cache.get(image_title)
+            if cached_info is not None:
+                yield image_title, cached_info
+                continue
+            batch.append(image_title)
+            if len(batch) == IMAGEINFO_BATCH_SIZE:
+                yield from self._resolve_batch(batch, cache)
+                batch = []
+        if batch:
+            yield from self._resolve_batch(batch, cache)
+
+    def _resolve_batch(self, image_titles: list, cache: PersistentRecordStore):
+        try:
+            resolved = self._query_image_info_batch(image_titles)
+        except (requests.RequestException, ValueError) as e:
+            self.logger.error(f"Failed to resolve image info for a batch of {len(image_titles)} titles: {e}")
+            return
+        for image_title, image_info in resolved.items():
+            # Titles without a file are cached too, so they are not re-queried on the next run.
+            image_info = image_info if image_info is not None else {"missing": True}
+            cache.set(image_title, image_info)
+            yield image_title, image_info
+
+    def _download_image(self, image_title: str, image_info: dict, output_dir: Path,
+                        manifest: DownloadManifest, content_index: ContentIndex) -> str:
+        """
+        Downloads a single, already resolved image and records the outcome in the manifest.
+        Content already present in the corpus (same SHA-1, under any name) is not downloaded again.
+        Returns one of 'downloaded', 'exists', 'duplicate', 'missing' or 'failed'.
+        """
+        if image_info.get("missing"):
+            manifest.record(image_title, "missing")
+            return "missing"
+
+        image_url = image_info["url"]
+        sha1 = image_info.get("sha1")
+        # Sanitize filename
+        image_name = "".join(c for c in Path(image_url).name if c.isalnum() or c in ('.', '_')).rstrip()
+
+        if sha1:
+            # The final name is reserved together with the content, so concurrent downloads of
+            # different files that sanitize to the same name never write to the same path.
+            holder, reserved_name = content_index.claim(sha1, image_name)
+            if holder in (image_name, content_index.disambiguated_name(image_name, sha1)):
+                manifest.record(image_title, "downloaded", filename=holder, url=image_url)
+                return "exists"
+            if holder is not None:
+                self.logger.debug(f"Skipping {image_title}: identical content already stored as {holder}.")
+                manifest.record(image_title, "duplicate", filename=holder, url=image_url)
+                return "duplicate"
+            image_name = reserved_name
+        elif (output_dir / image_name).exists():
+            manifest.record(image_title, "downloaded", filename=image_name, url=image_url)
+            return "exists"
+        output_path = output_dir / image_name
+
         try:
-            response = self.session.get(url=self.api_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            pages = data.get("query", {}).get("pages", {})
-            
-            for page_id in pages:
-                if "imageinfo" in pages[page_id]:
-                    image_url = pages[page_id]["imageinfo"][0]["url"]
-                    # Sanitize filename
-                    image_name = "".join(c for c in Path(image_url).name if c.isalnum() or c in ('.', '_')).rstrip()
-                    output_path = output_dir / image_name
-                    
-                    if not output_path.exists():
-                        img_response = self.session.get(image_url, stream=True)
-                        img_response.raise_for_status()
-                        with open(output_path, "wb") as f:
-                            for chunk in img_response.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                        return True
-        except requests.RequestException as e:
+            # Stream into a partial file so an interrupted transfer is never mistaken for a complete image.
+            partial_path = output_path.with_name(output_path.name + ".part")
+            with self._get_with_retry(image_url, stream=True) as img_response:
+                with open(partial_path, "wb") as f:
+                    for chunk in img_response.iter_content(chunk_size=65536):
+                        f.write(chunk)
+            os.replace(partial_path, output_path)
+        except (requests.RequestException, OSError) as e:
             self.logger.error(f"Failed to download image {image_title}: {e}")
-        return False
+            manifest.record(image_title, "failed", error=str(e))
+            if sha1:
+                content_index.release(sha1, image_name)
+            return "failed"
+
+        try:
+            content_index.add(image_name, output_path, sha1=sha1)
+        except Exception as e:
+            self.logger.warning(f"Downloaded {image_name} but could not index it. Error: {e}")
+        manifest.record(image_title, "downloaded", filename=image_name, url=image_url)
+        return "downloaded"
+
+    def _run_downloads(self, resolved_images, output_dir: Path, manifest: DownloadManifest,
+                       content_index: ContentIndex) -> dict:
+        """
+        Downloads (title, image info) pairs on a thread pool as they arrive, keeping at most
+        `2 * max_workers` tasks queued so memory stays flat however many titles are supplied.
+        """
+        outcome_counts = {"downloaded": 0, "exists": 0, "duplicate": 0, "missing": 0, "failed": 0}
+        max_in_flight = 2 * self.max_workers
+        in_flight = set()
+
+        def collect(done_futures):
+            for future in done_futures:
+                outcome_counts[future.result()] += 1
+                progress_bar.update(1)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                tqdm(desc="Downloading Images") as progress_bar:
+            for image_title, image_info in resolved_images:
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight.add(executor.submit(self._download_image, image_title, image_info, output_dir, manifest, content_index))
+            done, _ = wait(in_flight)
+            collect(done)
+
+        return outcome_counts
 
     def download_images_from_category(self, start_category: str, output_dir: Path, limit: int):
         """
         Downloads images from a starting Wikimedia category and its subcategories.
+        Crawling, URL resolution and file transfer are chained generators, so downloads start
+        as soon as the first titles are found. Titles already recorded in the download manifest
+        are skipped, so an interrupted run can simply be restarted, and files whose content is
+        already in the content index are skipped as duplicates.
         """
-        self.logger.info("Fetching list of all images in category tree...")
-        all_images = list(set(self._get_images_in_category_recursive(start_category, set())))
-        self.logger.info(f"Found {len(all_images)} total unique images.")
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = DownloadManifest(output_dir / "download_manifest.json")
+        image_info_cache = PersistentRecordStore(output_dir / "imageinfo_cache.json", flush_every=500)
+        content_index = ContentIndex(output_dir / "content_index.json")
+        content_index.update_from_directory(output_dir, INDEXED_EXTENSIONS)
+        skipped_titles = []
 
-        if not all_images:
+        def pending_titles():
+            for image_title in itertools.islice(self.iter_category_images(start_category), limit):
+                if manifest.is_complete(image_title, output_dir):
+                    skipped_titles.append(image_title)
+                else:
+                    yield image_title
+
+        self.logger.info(f"Crawling '{start_category}' and downloading up to {limit} images with {self.max_workers} workers...")
+        try:
+            resolved_images = self.iter_resolved_images(pending_titles(), image_info_cache)
+            outcome_counts = self._run_downloads(resolved_images, output_dir, manifest, content_index)
+        finally:
+            manifest.flush()
+            image_info_cache.flush()
+            content_index.flush()
+            self.logger.info(f"Download manifest saved to: {manifest.path}")
+
+        if skipped_titles:
+            self.logger.info(f"Resumed: {len(skipped_titles)} images were already handled according to the manifest.")
+        if not skipped_titles and not any(outcome_counts.values()):
             self.logger.warning("No images found in the specified category tree.")
             return
 
-        images_to_download = all_images[:limit]
-        self.logger.info(f"Attempting to download up to {len(images_to_download)} images.")
-
-        output_dir.mkdir(parents=True, exist_ok=True)
-        
-        download_count = 0
-        for image_title in tqdm(images_to_download, desc="Downloading Images"):
-            if self._download_image(image_title, output_dir):
-                download_count += 1
-        
-        self.logger.info(f"Successfully downloaded {download_count} new images to {output_dir}")
+        self.logger.info(f"Successfully downloaded {outcome_counts['downloaded']} new images to {output_dir}")
+        self.logger.info(f"Download summary: {outcome_counts}")
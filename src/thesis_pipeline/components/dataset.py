@@ -1,39 +1,74 @@
 # src/thesis_pipeline/components/dataset.py
+import io
+import csv
+import json
 import logging
 from pathlib import Path
 from PIL import Image
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
+from thesis_pipeline.components.packed_dataset import PackedShardReader
+from thesis_pipeline.components.masking import INPAINTING_MANIFEST_FILENAME
 
 class InpaintingDataset(Dataset):
     """
     A PyTorch Dataset for the image inpainting task.
-    It loads a ground truth image and its corresponding mask.
+    It loads a ground truth image and its corresponding mask, either from loose PNG files
+    or from the tar shards written by the packed output format of stage 05. Loose files are taken
+    from the dataset's 'inpainting_manifest.csv' when present, so directories are not listed and
+    images and masks are paired by name.
+    With a `cache_dir`, the split is decoded once into memory-mapped uint8 arrays (images plus
+    bit-packed masks) and later epochs build tensors straight from the memmap. The cache is rebuilt
+    when any source file changes.
+    With `load_masks=False` only the ground truth is returned, for training with masks generated on the fly.
     """
-    def __init__(self, data_dir: Path, image_size: list, split_name: str):
+    def __init__(self, data_dir: Path, image_size: list, split_name: str, packed: bool = False,
+                 cache_dir: Path = None, load_masks: bool = True):
         """
         Args:
             data_dir (Path): Path to the root of the inpainting dataset.
             image_size (list): The target size [height, width] to resize images to.
             split_name (str): The name of the split to load ('train', 'validation', 'test').
+            packed (bool): Read the split from its 'packed' shards instead of loose files.
+            cache_dir (Path): Optional directory for the decoded memmap cache of this split.
+            load_masks (bool): Load the stored mask of every sample. When False, samples only contain 'original_image'.
         """
-        self.image_dir = data_dir / split_name / 'ground_truth'
-        self.mask_dir = data_dir / split_name / 'masks'
         self.logger = logging.getLogger(__name__)
-        
-        self.image_files = sorted([p for p in self.image_dir.glob('*.png') if p.is_file()])
-        self.mask_files = sorted([p for p in self.mask_dir.glob('*.png') if p.is_file()])
+        self.packed_reader = None
+        self.load_masks = load_masks
+        self.image_size = list(image_size)
 
-        if not self.image_files:
-            self.logger.warning(f"No images found in {self.image_dir}. This split will be empty.")
-        if len(self.image_files) != len(self.mask_files):
-            raise ValueError(f"Number of images and masks do not match in '{split_name}' split!")
-        
-        self.logger.info(f"Loaded {len(self.image_files)} samples from '{split_name}' split.")
+        if packed:
+            self.packed_reader = PackedShardReader(data_dir / split_name / 'packed')
+            self.sample_names = self.packed_reader.keys
+            if not self.sample_names:
+                self.logger.warning(f"No samples found in {self.packed_reader.packed_dir}. This split will be empty.")
+        else:
+            self.image_dir = data_dir / split_name / 'ground_truth'
+            self.mask_dir = data_dir / split_name / 'masks'
+
+            manifest_path = data_dir / INPAINTING_MANIFEST_FILENAME
+            if manifest_path.exists():
+                with open(manifest_path, "r", encoding="utf-8", newline="") as f:
+                    rows = sorted((row for row in csv.DictReader(f) if row["split"] == split_name), key=lambda row: row["filename"])
+                self.image_files = [data_dir / row["image"] for row in rows]
+                self.mask_files = [data_dir / row["mask"] for row in rows]
+            else:
+                self.image_files = sorted([p for p in self.image_dir.glob('*.png') if p.is_file()])
+                self.mask_files = sorted([p for p in self.mask_dir.glob('*.png') if p.is_file()])
+            self.sample_names = [p.name for p in self.image_files]
+
+            if not self.image_files:
+                self.logger.warning(f"No images found in {self.image_dir}. This split will be empty.")
+            if load_masks and len(self.image_files) != len(self.mask_files):
+                raise ValueError(f"Number of images and masks do not match in '{split_name}' split!")
+
+        self.logger.info(f"Loaded {len(self.sample_names)} samples from '{split_name}' split.")
 
         self.transform = transforms.Compose([
-            transforms.Resize(image_size, interpolation=transforms.InterpolationMode.BILINEar),
+            transforms.Resize(image_size, interpolation=transforms.InterpolationMode.BILINEAR),
             transforms.ToTensor(),
             transforms.Normalize([0.5], [0.5])
         ])
@@ -43,18 +78,129 @@ class InpaintingDataset(Dataset):
             transforms.ToTensor()
         ])
 
+        self.cache_dir = None
+        self._cached_images = None
+        self._cached_masks = None
+        if cache_dir is not None and self.sample_names:
+            self.cache_dir = Path(cache_dir) / split_name
+            self._build_decoded_cache(image_size, packed)
+
     def __len__(self):
-        return len(self.image_files)
+        return len(self.sample_names)
+
+    def _load_pair(self, idx) -> tuple:
+        """Returns the (RGB image, L mask) pair for a sample; the mask is None when masks are not loaded."""
+        if self.packed_reader is not None:
+            image_bytes, mask_bytes = self.packed_reader.read(idx)
+            original_image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            mask = Image.open(io.BytesIO(mask_bytes)).convert("L") if self.load_masks else None
+            return original_image, mask
+        original_image = Image.open(self.image_files[idx]).convert("RGB")
+        mask = Image.open(self.mask_files[idx]).convert("L") if self.load_masks else None
+        return original_image, mask
+
+    def sample_fingerprint(self, idx) -> str:
+        """
+        Identifies the files sample `idx` is read from by their mtime_ns and size (for packed splits,
+        the shard plus the sample's member offsets), so a source regenerated under the same name is
+        told apart from the old one without decoding either.
+        """
+        if self.packed_reader is not None:
+            sample = self.packed_reader.samples[idx]
+            paths = [self.packed_reader.packed_dir / sample["shard"]]
+            offsets = [*sample["image"], *sample["mask"]]
+        else:
+            paths = [self.image_files[idx]] + ([self.mask_files[idx]] if self.load_masks else [])
+            offsets = []
+        stats = [path.stat() for path in paths]
+        return ";".join([f"{stat.st_mtime_ns}:{stat.st_size}" for stat in stats] + [str(offset) for offset in offsets])
+
+    def _build_decoded_cache(self, image_size: list, packed: bool):
+        """
+        Decodes every sample once into the memmap cache, unless a complete cache of the same samples,
+        built from the same source files with the same settings, exists.
+        """
+        meta_path = self.cache_dir / "cache_meta.json"
+        expected_meta = {
+            "sample_names": self.sample_names, "image_size": list(image_size), "packed": packed, "load_masks": self.load_masks,
+            "sources": [self.sample_fingerprint(idx) for idx in range(len(self))]
+        }
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                if json.load(f) == expected_meta:
+                    self.logger.info(f"Using decoded cache at {self.cache_dir}")
+                    return
+            self.logger.info(f"Decoded cache at {self.cache_dir} is stale. Rebuilding.")
+            meta_path.unlink()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        height, width = image_size
+        images = np.lib.format.open_memmap(
+            self.cache_dir / "images.npy", mode="w+", dtype=np.uint8, shape=(len(self), height, width, 3)
+        )
+        masks = None
+        if self.load_masks:
+            masks = np.lib.format.open_memmap(
+                self.cache_dir / "masks.npy", mode="w+", dtype=np.uint8, shape=(len(self), height, (width + 7) // 8)
+            )
+        resize_image, resize_mask = self.transform.transforms[0], self.mask_transform.transforms[0]
+
+        self.logger.info(f"Decoding {len(self)} samples into the memmap cache at {self.cache_dir}...")
+        for idx in range(len(self)):
+            original_image, mask = self._load_pair(idx)
+            images[idx] = np.asarray(resize_image(original_image))
+            if masks is not None:
+                masks[idx] = np.packbits(np.asarray(resize_mask(mask)) >= 128, axis=-1)
+        images.flush()
+        if masks is not None:
+            masks.flush()
+        del images, masks
+
+        # The metadata file is written last, so an interrupted build is detected and redone.
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(expected_meta, f, ensure_ascii=False)
+        self.logger.info(f"Decoded cache saved to: {self.cache_dir}")
+
+    def _get_cached_item(self, idx) -> dict:
+        if self._cached_images is None:
+            # Opened lazily so every DataLoader worker maps the same files instead of receiving a pickled copy.
+            # Copy-on-write mode keeps the arrays writable, which torch.from_numpy requires, without copying.
+            self._cached_images = np.load(self.cache_dir / "images.npy", mmap_mode="c")
+            if self.load_masks:
+                self._cached_masks = np.load(self.cache_dir / "masks.npy", mmap_mode="c")
+
+        image_uint8 = torch.from_numpy(self._cached_images[idx])
+        # Equivalent to ToTensor() followed by Normalize([0.5], [0.5]).
+        original_image_tensor = image_uint8.permute(2, 0, 1).float().div_(127.5).sub_(1.0)
+        if not self.load_masks:
+            return {"original_image": original_image_tensor}
+
+        width = image_uint8.shape[1]
+        mask_bits = np.unpackbits(self._cached_masks[idx], axis=-1, count=width)
+        mask_tensor = torch.from_numpy(mask_bits).unsqueeze(0).float()
+        masked_image_tensor = original_image_tensor * (1 - mask_tensor)
+
+        return {
+            "original_image": original_image_tensor,
+            "masked_image": masked_image_tensor,
+            "mask": mask_tensor
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_cached_images"] = None
+        state["_cached_masks"] = None
+        return state
 
     def __getitem__(self, idx):
+        if self.cache_dir is not None:
+            return self._get_cached_item(idx)
         try:
-            image_path = self.image_files[idx]
-            mask_path = self.mask_files[idx]
-            
-            original_image = Image.open(image_path).convert("RGB")
-            mask = Image.open(mask_path).convert("L")
+            original_image, mask = self._load_pair(idx)
 
             original_image_tensor = self.transform(original_image)
+            if mask is None:
+                return {"original_image": original_image_tensor}
             mask_tensor = self.mask_transform(mask)
             
             masked_image_tensor = original_image_tensor * (1 - mask_tensor)
@@ -65,5 +211,5 @@ class InpaintingDataset(Dataset):
                 "mask": mask_tensor
             }
         except Exception as e:
-            self.logger.error(f"Error loading sample {idx} ({self.image_files[idx]}). Error: {e}")
+            self.logger.error(f"Error loading sample {idx} ({self.sample_names[idx]}). Error: {e}")
             return self.__getitem__((idx + 1) % len(self))
@@ -1,64 +1,171 @@
 # src/thesis_pipeline/components/exploratory_data_analysis.py
+import os
 import logging
+import numpy as np
 import pandas as pd
-from PIL import Image
 from pathlib import Path
-import matplotlib.pyplot as plt
+import matplotlib.style
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from tqdm import tqdm
+from thesis_pipeline.components.image_headers import read_image_header
+from thesis_pipeline.components.image_quality import QUALITY_COLUMNS, compute_quality_stats, quality_flags
+from thesis_pipeline.components.metadata_store import ImageMetadataStore, normalize_path
+
+HEADER_CHUNK_SIZE = 512 # Files per thread-pool task
+QUALITY_CHUNK_SIZE = 64 # Images decoded into thumbnails per thread-pool task
+
 
 class ExploratoryDataAnalyzer:
     """
     Encapsulates the logic for performing EDA on a directory of images.
+    Metadata is collected in one `os.scandir` walk of the tree, reading only image headers on a
+    thread pool, and the DataFrame is built from columnar arrays. With a metadata store, only new
+    or changed files (by path, mtime and size) are analyzed and the report is built from the store.
+    With `quality_config`, content statistics are also computed from downsampled thumbnails and
+    images are flagged against its thresholds.
     """
-    def __init__(self, input_dir: Path, output_dir: Path, extensions: list):
+    def __init__(self, input_dir: Path, output_dir: Path, extensions: list, num_workers: int = 8,
+                 metadata_store: ImageMetadataStore = None, quality_config: dict = None,
+                 plot_workers: int = 1, max_scatter_points: int = 10000):
         self.input_dir = input_dir
         self.output_dir = output_dir
-        self.extensions = extensions
+        self.extensions = {ext.lower() for ext in extensions}
+        # 0 means "use every core"; header reads are I/O bound, so more threads than cores is fine
+        self.num_workers = num_workers if num_workers > 0 else os.cpu_count()
+        self.metadata_store = metadata_store
+        self.plot_workers = plot_workers if plot_workers > 0 else os.cpu_count()
+        self.max_scatter_points = max_scatter_points
+        self.quality_config = quality_config if quality_config and quality_config.get("enabled", False) else None
         self.logger = logging.getLogger(__name__)
         self.df = None
 
-    def _get_image_files(self) -> list:
-        """Finds all image files with given extensions in the input directory."""
-        image_files = []
-        for ext in self.extensions:
-            image_files.extend(self.input_dir.rglob(f'*{ext}'))
-        self.logger.info(f"Found {len(image_files)} image files in {self.input_dir}.")
-        return image_files
-
-    def analyze_images(self, image_files: list):
-        """Analyzes a list of image files and creates a DataFrame with metadata."""
-        data = []
-        self.logger.info("Analyzing image metadata...")
-        for img_path in tqdm(image_files, desc="Analyzing Images"):
+    def _scan_image_files(self) -> pd.DataFrame:
+        """
+        Walks the input tree once with `os.scandir`. Returns (path, mtime_ns, size_bytes) of every
+        file with a matching extension; the stats come from the directory entries.
+        """
+        paths, mtimes, sizes = [], [], []
+        pending_dirs = [normalize_path(self.input_dir)]
+        while pending_dirs:
+            with os.scandir(pending_dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in self.extensions:
+                        stat = entry.stat()
+                        paths.append(entry.path)
+                        mtimes.append(stat.st_mtime_ns)
+                        sizes.append(stat.st_size)
+        self.logger.info(f"Found {len(paths)} image files in {self.input_dir}.")
+        return pd.DataFrame({
+            "path": np.array(paths, dtype=object),
+            "mtime_ns": np.array(mtimes, dtype=np.int64),
+            "size_bytes": np.array(sizes, dtype=np.int64)
+        })
+
+    @staticmethod
+    def _read_headers(paths: list) -> tuple:
+        """Reads (width, height, mode) for a chunk of files; unreadable files get width -1 and the error."""
+        widths = np.full(len(paths), -1, dtype=np.int64)
+        heights = np.full(len(paths), -1, dtype=np.int64)
+        modes = np.empty(len(paths), dtype=object)
+        errors = []
+        for i, path in enumerate(paths):
             try:
-                with Image.open(img_path) as img:
-                    width, height = img.size
-                    data.append({
-                        'filename': img_path.name,
-                        'width': width,
-                        'height': height,
-                        'aspect_ratio': width / height if height > 0 else 0,
-                        'mode': img.mode,
-                        'filesize_kb': img_path.stat().st_size / 1024
-                    })
+                widths[i], heights[i], modes[i] = read_image_header(path)
             except Exception as e:
-                self.logger.warning(f"Could not analyze image {img_path}. Error: {e}")
-        
-        self.df = pd.DataFrame(data)
+                errors.append((path, e))
+        return widths, heights, modes, errors
+
+    def analyze_images(self, scan: pd.DataFrame) -> pd.DataFrame:
+        """
+        Reads the headers of the scanned files on the thread pool. Returns their metadata records
+        (the scan columns plus filename, width, height, mode); unreadable files are left out.
+        """
+        self.logger.info(f"Analyzing metadata of {len(scan)} images with {self.num_workers} threads...")
+        paths = scan["path"].tolist()
+        chunks = [paths[i:i + HEADER_CHUNK_SIZE] for i in range(0, len(paths), HEADER_CHUNK_SIZE)]
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            results = list(tqdm(executor.map(self._read_headers, chunks), total=len(chunks), desc="Analyzing Images"))
+
+        widths = np.concatenate([r[0] for r in results]) if results else np.empty(0, dtype=np.int64)
+        heights = np.concatenate([r[1] for r in results]) if results else np.empty(0, dtype=np.int64)
+        modes = np.concatenate([r[2] for r in results]) if results else np.empty(0, dtype=object)
+        for path, error in (error for r in results for error in r[3]):
+            self.logger.warning(f"Could not analyze image {path}. Error: {error}")
+
+        valid = widths >= 0
+        records = scan[valid].reset_index(drop=True)
+        records["filename"] = records["path"].map(os.path.basename)
+        records["width"] = widths[valid]
+        records["height"] = heights[valid]
+        records["mode"] = modes[valid]
+        if self.quality_config is not None and not records.empty:
+            records = pd.concat([records, self._analyze_quality(records["path"].tolist())], axis=1)
+        return records
+
+    def _analyze_quality(self, paths: list) -> pd.DataFrame:
+        """Computes the QUALITY_COLUMNS of every image, one batch of thumbnails per thread-pool task."""
+        self.logger.info(f"Computing quality statistics of {len(paths)} images...")
+        analyze_chunk = partial(
+            compute_quality_stats,
+            thumbnail_size=self.quality_config["thumbnail_size"],
+            background_tolerance=self.quality_config["background_tolerance"]
+        )
+        chunks = [paths[i:i + QUALITY_CHUNK_SIZE] for i in range(0, len(paths), QUALITY_CHUNK_SIZE)]
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            results = list(tqdm(executor.map(analyze_chunk, chunks), total=len(chunks), desc="Quality Statistics"))
+        for path, error in (error for r in results for error in r[1]):
+            self.logger.warning(f"Could not compute quality statistics of {path}. Error: {error}")
+        return pd.concat([r[0] for r in results], ignore_index=True)
+
+    def _report_frame(self, records: pd.DataFrame) -> pd.DataFrame:
+        """Columns of the EDA report and metadata CSV, derived from metadata records."""
+        widths, heights = records["width"].to_numpy(), records["height"].to_numpy()
+        report = pd.DataFrame({
+            'filename': records["filename"].to_numpy(),
+            'width': widths,
+            'height': heights,
+            'aspect_ratio': np.divide(widths, heights, out=np.zeros(len(widths)), where=heights > 0),
+            'mode': records["mode"].to_numpy(),
+            'filesize_kb': records["size_bytes"].to_numpy() / 1024,
+            'extension': records["filename"].map(lambda name: os.path.splitext(name)[1].lower()).to_numpy()
+        })
+        if self.quality_config is not None:
+            stats = records[QUALITY_COLUMNS].astype(float).reset_index(drop=True)
+            report = pd.concat([report, stats], axis=1)
+            report['quality_flags'] = quality_flags(stats, self.quality_config["thresholds"])
+        return report
 
     def generate_visualizations(self):
-        """Generates and saves plots based on the image analysis DataFrame."""
+        """
+        Generates and saves plots based on the image analysis DataFrame. Each plot is rendered
+        with the object-oriented Agg API from plain arrays, so the plots can be drawn in parallel
+        worker processes; above `max_scatter_points` images the dimensions plot becomes a hexbin.
+        """
         if self.df is None or self.df.empty:
             self.logger.warning("DataFrame is empty. Skipping visualization generation.")
             return
 
-        plt.style.use('ggplot')
-        
-        # Plotting functions
-        self._plot_histogram('width', 'skyblue', 'Width (pixels)')
-        self._plot_histogram('height', 'salmon', 'Height (pixels)')
-        self._plot_scatter('width', 'height', 'Image Dimensions (Width vs. Height)')
-        self._plot_pie_chart()
+        widths, heights = self.df['width'].to_numpy(), self.df['height'].to_numpy()
+        plots = [
+            (_plot_histogram, dict(values=widths, column='width', color='skyblue', xlabel='Width (pixels)')),
+            (_plot_histogram, dict(values=heights, column='height', color='salmon', xlabel='Height (pixels)')),
+            (_plot_dimensions, dict(widths=widths, heights=heights, max_scatter_points=self.max_scatter_points)),
+            (_plot_pie_chart, dict(counts=self.df['extension'].value_counts())),
+        ]
+
+        if self.plot_workers == 1:
+            for plot_func, kwargs in plots:
+                plot_func(output_dir=self.output_dir, **kwargs)
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.plot_workers, len(plots))) as executor:
+                futures = [executor.submit(plot_func, output_dir=self.output_dir, **kwargs) for plot_func, kwargs in plots]
+                for future in futures:
+                    future.result()
 
         self.logger.info(f"All visualizations saved to: {self.output_dir}")
 
@@ -73,6 +180,9 @@ class ExploratoryDataAnalyzer:
         summary_path = self.output_dir / 'summary_statistics.txt'
         with open(summary_path, 'w') as f:
             f.write(f"Total Images Analyzed: {len(self.df)}\n\n{summary_stats.to_string()}")
+            if 'quality_flags' in self.df:
+                flag_counts = self.df['quality_flags'].str.split(',').explode().value_counts().drop('', errors='ignore')
+                f.write(f"\n\nQuality Flags (images per flag):\n{flag_counts.to_string() if not flag_counts.empty else 'none'}")
         self.logger.info(f"Summary statistics saved to {summary_path}")
 
         # Full Metadata CSV
@@ -80,43 +190,72 @@ class ExploratoryDataAnalyzer:
         self.df.to_csv(csv_path, index=False)
         self.logger.info(f"Full metadata saved to {csv_path}")
 
+        if 'quality_flags' in self.df:
+            flagged = self.df[self.df['quality_flags'] != '']
+            flagged_path = self.output_dir / 'flagged_images.csv'
+            flagged[['filename', 'quality_flags']].to_csv(flagged_path, index=False)
+            self.logger.info(f"{len(flagged)} of {len(self.df)} images have quality flags; list saved to {flagged_path}")
+
     def run(self):
         """Executes the full EDA process."""
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        image_files = self._get_image_files()
-        if not image_files:
+        scan = self._scan_image_files()
+        if scan.empty:
             self.logger.warning("No image files found. EDA concluded.")
             return
-        
-        self.analyze_images(image_files)
+
+        if self.metadata_store is None:
+            records = self.analyze_images(scan)
+        else:
+            required_columns = ["mean_r", "std_luma"] if self.quality_config is not None else []
+            stale = self.metadata_store.find_stale(scan, required_columns)
+            self.logger.info(f"{len(scan) - len(stale)} images are unchanged in the metadata store; analyzing {len(stale)}.")
+            self.metadata_store.upsert(self.analyze_images(stale))
+            removed = self.metadata_store.prune(self.input_dir, scan["path"])
+            if removed:
+                self.logger.info(f"Removed {removed} deleted images from the metadata store.")
+            records = self.metadata_store.query(self.input_dir)
+        self.df = self._report_frame(records)
         self.generate_visualizations()
         self.save_summary()
 
-    # --- Helper plotting methods ---
-    def _plot_histogram(self, column, color, xlabel):
-        plt.figure(figsize=(12, 6))
-        plt.hist(self.df[column], bins=50, color=color, edgecolor='black')
-        plt.title(f'Distribution of Image {column.title()}s')
-        plt.xlabel(xlabel)
-        plt.ylabel('Frequency')
-        plt.savefig(self.output_dir / f'{column}_distribution.png')
-        plt.close()
-
-    def _plot_scatter(self, x_col, y_col, title):
-        plt.figure(figsize=(10, 10))
-        plt.scatter(self.df[x_col], self.df[y_col], alpha=0.6, edgecolors='w', s=50)
-        plt.title(title)
-        plt.xlabel(f'{x_col.title()} (pixels)')
-        plt.ylabel(f'{y_col.title()} (pixels)')
-        plt.savefig(self.output_dir / 'dimensions_scatter_plot.png')
-        plt.close()
-
-    def _plot_pie_chart(self):
-        plt.figure(figsize=(8, 8))
-        self.df['extension'] = self.df['filename'].apply(lambda x: Path(x).suffix.lower())
-        ext_counts = self.df['extension'].value_counts()
-        ext_counts.plot(kind='pie', autopct='%1.1f%%', startangle=90)
-        plt.title('Distribution of Image File Formats')
-        plt.ylabel('')
-        plt.savefig(self.output_dir / 'file_format_distribution.png')
-        plt.close()
+
+# --- Plotting functions (module level, so they can run in worker processes) ---
+def _new_figure(figsize: tuple) -> tuple:
+    """A standalone Agg figure and axes, independent of pyplot's global state. Styles apply from the caller's context."""
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def _plot_histogram(values: np.ndarray, column: str, color: str, xlabel: str, output_dir: Path):
+    with matplotlib.style.context('ggplot'):
+        fig, ax = _new_figure((12, 6))
+        ax.hist(values, bins=50, color=color, edgecolor='black')
+        ax.set_title(f'Distribution of Image {column.title()}s')
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Frequency')
+        fig.savefig(output_dir / f'{column}_distribution.png')
+
+
+def _plot_dimensions(widths: np.ndarray, heights: np.ndarray, max_scatter_points: int, output_dir: Path):
+    """Width vs. height: a scatter plot for small corpora, a log-scaled hexbin density above `max_scatter_points`."""
+    with matplotlib.style.context('ggplot'):
+        fig, ax = _new_figure((10, 10))
+        if len(widths) > max_scatter_points:
+            hexbin = ax.hexbin(widths, heights, gridsize=60, bins='log', mincnt=1, cmap='viridis')
+            fig.colorbar(hexbin, ax=ax, label='Images per bin (log)')
+        else:
+            ax.scatter(widths, heights, alpha=0.6, edgecolors='w', s=50)
+        ax.set_title('Image Dimensions (Width vs. Height)')
+        ax.set_xlabel('Width (pixels)')
+        ax.set_ylabel('Height (pixels)')
+        fig.savefig(output_dir / 'dimensions_scatter_plot.png')
+
+
+def _plot_pie_chart(counts: pd.Series, output_dir: Path):
+    with matplotlib.style.context('ggplot'):
+        fig, ax = _new_figure((8, 8))
+        ax.pie(counts.to_numpy(), labels=counts.index, autopct='%1.1f%%', startangle=90)
+        ax.set_title('Distribution of Image File Formats')
+        fig.savefig(output_dir / 'file_format_distribution.png')
@@ -0,0 +1,75 @@
+# src/thesis_pipeline/components/image_headers.py
+import struct
+from pathlib import Path
+from PIL import Image
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG colour type -> PIL mode (8-bit samples)
+PNG_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+# JPEG start-of-frame markers carry the image size; C4 (DHT), C8 (JPG) and CC (DAC) do not
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+
+
+def _read_png_header(f) -> tuple:
+    header = f.read(26)
+    if header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+    width, height, bit_depth, colour_type = struct.unpack(">IIBB", header[16:26])
+    if colour_type == 0 and bit_depth == 1:
+        return width, height, "1"
+    if colour_type == 0 and bit_depth == 16:
+        return width, height, "I;16"
+    return width, height, PNG_MODES.get(colour_type)
+
+
+def _read_jpeg_header(f) -> tuple:
+    """
+    Walks the JPEG segments up to the first start-of-frame, seeking over everything else.
+    Returns None when the segments are malformed or the file ends early.
+    """
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        while marker[1] == 0xFF:  # Fill bytes before a marker
+            next_byte = f.read(1)
+            if not next_byte:
+                return None
+            marker = marker[1:] + next_byte
+        try:
+            segment_length = struct.unpack(">H", f.read(2))[0]
+            if marker[1] in JPEG_SOF_MARKERS:
+                _, height, width, components = struct.unpack(">BHHB", f.read(6))
+                return width, height, JPEG_MODES.get(components)
+        except struct.error:  # Truncated file; let PIL report it
+            return None
+        f.seek(segment_length - 2, 1)
+
+
+def read_image_header(path: Path) -> tuple:
+    """
+    Returns (width, height, mode) of an image without decoding it. PNG and JPEG headers are parsed
+    directly from the first few bytes; other formats (and anything unusual) fall back to PIL,
+    which also only reads the header when opening a file.
+    """
+    with open(path, "rb") as f:
+        start = f.read(2)
+        f.seek(0)
+        header = None
+        if start == b"\x89P":
+            header = _read_png_header(f)
+        elif start == b"\xff\xd8":
+            header = _read_jpeg_header(f)
+    if header is not None and header[2] is not None:
+        return header
+    with Image.open(path) as img:
+        return img.width, img.height, img.mode
+
+
+def read_image_size(path: Path) -> tuple:
+    """Returns the (width, height) of an image from its header."""
+    width, height, _ = read_image_header(path)
+    return width, height
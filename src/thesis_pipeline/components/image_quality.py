@@ -0,0 +1,158 @@
+# src/thesis_pipeline/components/image_quality.py
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from PIL import Image
+
+# ==============================================================================
+# Image Content Statistics
+# ==============================================================================
+# Every image is decoded into a small square RGB thumbnail (JPEGs at reduced
+# DCT scale), and the statistics of a whole chunk of thumbnails are computed
+# together in numpy. Only JPEG blockiness is measured per image, on a
+# full-resolution centre crop of the luma, since it needs the 8x8 coding grid
+# that a thumbnail no longer has.
+
+HISTOGRAM_BINS = 8 # Per channel; bins are equal-width over 0-255
+CHANNELS = ["r", "g", "b"]
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+JPEG_BLOCK_SIZE = 8
+BLOCKINESS_CROP = 512 # Side of the full-resolution centre crop used for blockiness
+QUALITY_COLUMNS = (
+    [f"mean_{c}" for c in CHANNELS]
+    + [f"std_{c}" for c in CHANNELS]
+    + ["std_luma", "laplacian_variance", "blockiness", "background_fraction"]
+    + [f"hist_{c}_{i}" for c in CHANNELS for i in range(HISTOGRAM_BINS)]
+)
+
+
+def _blockiness(gray: np.ndarray, grid: int) -> float:
+    """
+    Mean absolute gradient across coding-block boundaries divided by the mean gradient inside
+    blocks, averaged over both axes. About 1.0 for clean images, higher for visible blocking.
+    """
+    ratios = []
+    for axis in (0, 1):
+        diffs = np.abs(np.diff(gray, axis=axis)).mean(axis=1 - axis)
+        if len(diffs) < 2 * grid:
+            continue
+        on_boundary = (np.arange(1, len(diffs) + 1) % grid) == 0
+        ratios.append(diffs[on_boundary].mean() / max(diffs[~on_boundary].mean(), 1e-3))
+    return float(np.mean(ratios)) if ratios else np.nan
+
+
+def _centre_crop_blockiness(gray: Image.Image) -> float:
+    """Blockiness of a centre crop of up to BLOCKINESS_CROP pixels of a full-resolution 'L' image."""
+    # The crop starts on the coding grid, so block boundaries stay at multiples of 8.
+    top = (gray.height - min(BLOCKINESS_CROP, gray.height)) // 2 // JPEG_BLOCK_SIZE * JPEG_BLOCK_SIZE
+    left = (gray.width - min(BLOCKINESS_CROP, gray.width)) // 2 // JPEG_BLOCK_SIZE * JPEG_BLOCK_SIZE
+    crop = gray.crop((left, top, min(left + BLOCKINESS_CROP, gray.width), min(top + BLOCKINESS_CROP, gray.height)))
+    return _blockiness(np.asarray(crop, dtype=np.float32), JPEG_BLOCK_SIZE)
+
+
+def load_thumbnail(path: Path, thumbnail_size: int) -> tuple:
+    """
+    Returns (thumbnail, blockiness): a (size, size, 3) uint8 RGB thumbnail and the blockiness of
+    the image. Large JPEGs are decoded twice: the thumbnail from a draft (DCT-scaled) decode, and
+    the blockiness crop from a full-resolution decode of the luma only, because draft decoding
+    smooths away the block edges that blockiness measures. Other images are decoded once for both.
+    """
+    with Image.open(path) as img:
+        full_size = img.size
+        if img.format == "JPEG":
+            img.draft("RGB", (2 * thumbnail_size, 2 * thumbnail_size))
+        rgb = img.convert("RGB")
+        if rgb.size == full_size: # Not a JPEG, or too small to be draft-decoded
+            blockiness = _centre_crop_blockiness(rgb.convert("L"))
+        else:
+            with Image.open(path) as full:
+                full.draft("L", full.size) # Grayscale output: the chroma planes are skipped, not scaled
+                blockiness = _centre_crop_blockiness(full.convert("L"))
+
+    # reducing_gap shrinks by an integer factor with a cheap box filter before the final resample.
+    thumbnail = np.asarray(
+        rgb.resize((thumbnail_size, thumbnail_size), Image.BILINEAR, reducing_gap=2.0), dtype=np.uint8
+    )
+    return thumbnail, blockiness
+
+
+def batch_quality_stats(thumbnails: np.ndarray, background_tolerance: float) -> dict:
+    """
+    Statistics of a batch of thumbnails (N, S, S, 3) uint8, as a dict of (N,) arrays keyed like
+    QUALITY_COLUMNS (without blockiness):
+      - per-channel mean and standard deviation, and the standard deviation of the luma;
+      - variance of the 4-neighbour Laplacian of the luma, a blur measure (low = blurry);
+      - the fraction of pixels within `background_tolerance` of the median border colour, i.e.
+        the share of the frame taken by a uniform backdrop;
+      - a normalized HISTOGRAM_BINS-bin histogram per channel.
+    """
+    num_images, size = thumbnails.shape[0], thumbnails.shape[1]
+    pixels = thumbnails.reshape(num_images, -1, 3).astype(np.float32)
+    stats = {}
+    means, stds = pixels.mean(axis=1), pixels.std(axis=1)
+    for i, c in enumerate(CHANNELS):
+        stats[f"mean_{c}"] = means[:, i]
+        stats[f"std_{c}"] = stds[:, i]
+
+    luma = pixels.reshape(num_images, size, size, 3) @ LUMA_WEIGHTS
+    stats["std_luma"] = luma.reshape(num_images, -1).std(axis=1)
+    laplacian = (luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1] + luma[:, 1:-1, :-2] + luma[:, 1:-1, 2:]
+                 - 4 * luma[:, 1:-1, 1:-1])
+    stats["laplacian_variance"] = laplacian.reshape(num_images, -1).var(axis=1)
+
+    border = np.concatenate([thumbnails[:, 0], thumbnails[:, -1], thumbnails[:, 1:-1, 0], thumbnails[:, 1:-1, -1]], axis=1)
+    background = np.median(border, axis=1).astype(np.float32)
+    distance = np.abs(pixels - background[:, None, :]).max(axis=2)
+    stats["background_fraction"] = (distance <= background_tolerance).mean(axis=1)
+
+    # One bincount over (image, channel, bin) indices fills every histogram at once.
+    bins = thumbnails.reshape(num_images, -1, 3) // (256 // HISTOGRAM_BINS)
+    flat_index = (np.arange(num_images)[:, None, None] * 3 + np.arange(3)) * HISTOGRAM_BINS + bins
+    counts = np.bincount(flat_index.ravel(), minlength=num_images * 3 * HISTOGRAM_BINS)
+    histograms = counts.reshape(num_images, 3, HISTOGRAM_BINS) / (size * size)
+    for i, c in enumerate(CHANNELS):
+        for b in range(HISTOGRAM_BINS):
+            stats[f"hist_{c}_{b}"] = histograms[:, i, b]
+    return stats
+
+
+def compute_quality_stats(paths: list, thumbnail_size: int, background_tolerance: float) -> tuple:
+    """
+    Decodes a chunk of images into thumbnails and computes their statistics in one batch.
+    Returns (DataFrame with QUALITY_COLUMNS, one row per path, NaN where decoding failed; errors).
+    """
+    thumbnails = np.zeros((len(paths), thumbnail_size, thumbnail_size, 3), dtype=np.uint8)
+    blockiness = np.full(len(paths), np.nan)
+    decoded = np.zeros(len(paths), dtype=bool)
+    errors = []
+    for i, path in enumerate(paths):
+        try:
+            thumbnails[i], blockiness[i] = load_thumbnail(path, thumbnail_size)
+            decoded[i] = True
+        except Exception as e:
+            errors.append((path, e))
+
+    stats = pd.DataFrame(np.nan, index=range(len(paths)), columns=QUALITY_COLUMNS)
+    if decoded.any():
+        batch = batch_quality_stats(thumbnails[decoded], background_tolerance)
+        for column, values in batch.items():
+            stats.loc[decoded, column] = values
+        stats.loc[decoded, "blockiness"] = blockiness[decoded]
+    return stats, errors
+
+
+def quality_flags(stats: pd.DataFrame, thresholds: dict) -> pd.Series:
+    """
+    Comma-separated quality flags per image ('' when none apply), from thresholds on the stored
+    statistics. Flags are derived at report time, so changing a threshold needs no re-analysis.
+    """
+    conditions = {
+        "blurry": stats["laplacian_variance"] < thresholds["min_laplacian_variance"],
+        "blocky": stats["blockiness"] > thresholds["max_blockiness"],
+        "mostly_background": stats["background_fraction"] > thresholds["max_background_fraction"],
+        "low_contrast": stats["std_luma"] < thresholds["min_luma_std"],
+    }
+    flags = pd.Series("", index=stats.index)
+    for name, condition in conditions.items():
+        flags = flags.where(~condition.fillna(False), flags + "," + name)
+    return flags.str.lstrip(",")
@@ -0,0 +1,137 @@
+# src/thesis_pipeline/components/latent_cache.py
+import json
+import hashlib
+import logging
+from pathlib import Path
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+from tqdm.auto import tqdm
+
+INDEX_FILENAME = "index.json"
+CACHED_FIELDS = ["latent_mean", "latent_logvar", "masked_latent_mean", "masked_latent_logvar", "latent_mask"]
+
+
+def sample_key(sample_name: str, source_fingerprint: str, image_size: list) -> str:
+    """
+    Identifies an (image, mask) pair by its name, the identity of its source files and the size it
+    is encoded at, so a pair regenerated under the same name gets a new key without being decoded.
+    """
+    return hashlib.sha1(f"{sample_name}|{source_fingerprint}|{list(image_size)}".encode("utf-8")).hexdigest()
+
+
+def sample_from_cache(mean: torch.Tensor, logvar: torch.Tensor) -> torch.Tensor:
+    """Draws a latent from cached distribution parameters, as `AutoencoderKL.encode(...).latent_dist.sample()` does."""
+    std = torch.exp(0.5 * torch.clamp(logvar, -30.0, 20.0))
+    return mean + std * torch.randn_like(mean)
+
+
+class LatentCache:
+    """
+    Sharded on-disk store of VAE latent-distribution parameters (mean/logvar) for the original and
+    masked image of every (image, mask) pair, plus the mask downsampled to latent resolution.
+    Each shard is a directory of float16 .npy arrays so samples can be read through memmaps.
+    """
+    def __init__(self, cache_dir: Path, shard_size: int):
+        self.cache_dir = Path(cache_dir)
+        self.shard_size = shard_size
+        self.logger = logging.getLogger(__name__)
+
+    def _read_index(self):
+        index_path = self.cache_dir / INDEX_FILENAME
+        if not index_path.exists():
+            return None
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _compute_keys(self, dataset) -> list:
+        """Keys of every sample of an InpaintingDataset, from file metadata only."""
+        return [
+            sample_key(dataset.sample_names[idx], dataset.sample_fingerprint(idx), dataset.image_size)
+            for idx in range(len(dataset))
+        ]
+
+    @torch.no_grad()
+    def build(self, vae, dataset, batch_size: int, device) -> "CachedLatentDataset":
+        """
+        Encodes every sample of `dataset` once with the frozen VAE, unless a cache built from the
+        same (image, mask) pairs already exists. Returns a dataset serving the cached parameters.
+        """
+        keys = self._compute_keys(dataset)
+        index = self._read_index()
+        if index is not None and index["keys"] == keys:
+            self.logger.info(f"Using latent cache at {self.cache_dir} ({len(keys)} samples).")
+            return CachedLatentDataset(self.cache_dir)
+        if index is not None:
+            self.logger.info(f"Latent cache at {self.cache_dir} does not match the dataset. Rebuilding.")
+            (self.cache_dir / INDEX_FILENAME).unlink()
+
+        self.logger.info(f"Encoding {len(keys)} samples into the latent cache at {self.cache_dir}...")
+        shards = []
+        for shard_start in tqdm(range(0, len(dataset), self.shard_size), desc="Building latent cache shards"):
+            shard_indices = range(shard_start, min(shard_start + self.shard_size, len(dataset)))
+            shard_fields = {field: [] for field in CACHED_FIELDS}
+
+            for batch_start in range(0, len(shard_indices), batch_size):
+                samples = [dataset[idx] for idx in shard_indices[batch_start:batch_start + batch_size]]
+                original_images = torch.stack([s["original_image"] for s in samples]).to(device, dtype=vae.dtype)
+                masked_images = torch.stack([s["masked_image"] for s in samples]).to(device, dtype=vae.dtype)
+                masks = torch.stack([s["mask"] for s in samples])
+
+                latent_dist = vae.encode(original_images).latent_dist
+                masked_latent_dist = vae.encode(masked_images).latent_dist
+                shard_fields["latent_mean"].append(latent_dist.mean.cpu())
+                shard_fields["latent_logvar"].append(latent_dist.logvar.cpu())
+                shard_fields["masked_latent_mean"].append(masked_latent_dist.mean.cpu())
+                shard_fields["masked_latent_logvar"].append(masked_latent_dist.logvar.cpu())
+                shard_fields["latent_mask"].append(F.interpolate(masks, size=latent_dist.mean.shape[-2:]))
+
+            shard_name = f"shard_{len(shards):05d}"
+            shard_dir = self.cache_dir / shard_name
+            shard_dir.mkdir(parents=True, exist_ok=True)
+            for field, tensors in shard_fields.items():
+                np.save(shard_dir / f"{field}.npy", torch.cat(tensors).to(torch.float16).numpy())
+            shards.append({"name": shard_name, "count": len(shard_indices)})
+
+        # The index is written last, so an interrupted build is detected and redone.
+        with open(self.cache_dir / INDEX_FILENAME, "w", encoding="utf-8") as f:
+            json.dump({"keys": keys, "shards": shards}, f)
+        self.logger.info(f"Latent cache saved to: {self.cache_dir} ({len(shards)} shards)")
+        return CachedLatentDataset(self.cache_dir)
+
+
+class CachedLatentDataset(Dataset):
+    """
+    Serves the cached latent-distribution parameters of a LatentCache. Shard arrays are memory-mapped
+    lazily in each DataLoader worker, so the whole cache never has to fit in memory.
+    """
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        with open(self.cache_dir / INDEX_FILENAME, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        self.shard_offsets = np.cumsum([0] + [shard["count"] for shard in self.shards])
+        self._arrays = {}
+
+    def __len__(self):
+        return int(self.shard_offsets[-1])
+
+    def _shard_arrays(self, shard_idx: int) -> dict:
+        arrays = self._arrays.get(shard_idx)
+        if arrays is None:
+            shard_dir = self.cache_dir / self.shards[shard_idx]["name"]
+            arrays = {field: np.load(shard_dir / f"{field}.npy", mmap_mode="r") for field in CACHED_FIELDS}
+            self._arrays[shard_idx] = arrays
+        return arrays
+
+    def __getitem__(self, idx):
+        shard_idx = int(np.searchsorted(self.shard_offsets, idx, side="right")) - 1
+        arrays = self._shard_arrays(shard_idx)
+        offset = idx - self.shard_offsets[shard_idx]
+        return {field: torch.from_numpy(np.array(arrays[field][offset], dtype=np.float32)) for field in CACHED_FIELDS}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"] = {}
+        return state
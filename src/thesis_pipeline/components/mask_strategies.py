@@ -0,0 +1,242 @@
+# src/thesis_pipeline/components/mask_strategies.py
+import numpy as np
+
+# ==============================================================================
+# Batched Mask Strategies
+# ==============================================================================
+# Every strategy generates N masks per call from a numpy Generator and returns a
+# bool array of shape (N, height, width), True where the image is masked out.
+# Strategy parameters come from `feature_engineering.mask_config`; anything not
+# set there falls back to the defaults below.
+#
+# Measured with scripts/benchmark_mask_strategies.py at 64x64 on one CPU core:
+# random_rectangle about 200k masks/sec, multi_rectangle and edge_biased about
+# 60k/sec, brush_stroke and crack about 35-40k/sec (25-30 s per million). The
+# stroke strategies are bound by scattering the sampled points of every segment
+# and by the brush dilation, both of which already run on the whole batch.
+
+MASK_STRATEGIES = {}
+
+
+def register_mask_strategy(name: str):
+    """Decorator adding a batched mask generator to MASK_STRATEGIES under `name`."""
+    def decorator(func):
+        MASK_STRATEGIES[name] = func
+        return func
+    return decorator
+
+
+def _integers(rng: np.random.Generator, low, high, size) -> np.ndarray:
+    """Uniform integers in [low, high], inclusive, like `random.randint`."""
+    return rng.integers(low, np.asarray(high) + 1, size=size)
+
+
+def _rectangles(rng: np.random.Generator, num_masks: int, height: int, width: int, config: dict) -> tuple:
+    """Returns (row coverage (N, H), column coverage (N, W)) of one random rectangle per mask."""
+    min_ratio, max_ratio = config["min_mask_size_ratio"], config["max_mask_size_ratio"]
+    mask_heights = _integers(rng, int(min_ratio * height), int(max_ratio * height), num_masks)
+    mask_widths = _integers(rng, int(min_ratio * width), int(max_ratio * width), num_masks)
+    tops = _integers(rng, 0, height - mask_heights, num_masks)
+    lefts = _integers(rng, 0, width - mask_widths, num_masks)
+
+    rows, cols = np.arange(height), np.arange(width)
+    inside_rows = (rows >= tops[:, None]) & (rows < (tops + mask_heights)[:, None])
+    inside_cols = (cols >= lefts[:, None]) & (cols < (lefts + mask_widths)[:, None])
+    return inside_rows, inside_cols
+
+
+def _dilate_axis(masks: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    """
+    ORs every pixel with its neighbours up to `radius` away along `axis`. The window is grown
+    symmetrically by doubling, so a radius r costs about 2 log2(r + 1) shifted ORs instead of 2r.
+    """
+    dilated = masks
+    lower, upper = [slice(None)] * masks.ndim, [slice(None)] * masks.ndim
+    span = 0  # dilated[i] currently covers masks[i - span .. i + span]
+    while span < radius:
+        shift = min(span + 1, radius - span)
+        lower[axis], upper[axis] = slice(None, -shift), slice(shift, None)
+        # ORing from the previous step's array, never in place, avoids numpy's overlap copies.
+        previous, dilated = dilated, dilated.copy()
+        dilated[tuple(upper)] |= previous[tuple(lower)]
+        dilated[tuple(lower)] |= previous[tuple(upper)]
+        span += shift
+    return dilated
+
+
+def _box_dilate(masks: np.ndarray, radii: np.ndarray) -> np.ndarray:
+    """Dilates each mask by a (2r+1)-pixel square, with r taken per mask from `radii`."""
+    radius_values = np.unique(radii)
+    if len(radius_values) == 1: # The whole batch shares one radius; no per-group copies needed
+        radius = int(radius_values[0])
+        return _dilate_axis(_dilate_axis(masks, radius, axis=1), radius, axis=2) if radius > 0 else masks
+    dilated = masks.copy()
+    for radius in radius_values[radius_values > 0]:
+        group = radii == radius
+        dilated[group] = _dilate_axis(_dilate_axis(masks[group], int(radius), axis=1), int(radius), axis=2)
+    return dilated
+
+
+def _random_walks(rng: np.random.Generator, starts: np.ndarray, num_steps: int, step_lengths: tuple,
+                  angle_jitter: float) -> np.ndarray:
+    """
+    Random polylines from `starts` (..., 2) as (y, x): each step turns by a normal angle with
+    std `angle_jitter` and moves a uniform length in `step_lengths`. Returns (..., num_steps + 1, 2).
+    """
+    batch_shape = starts.shape[:-1]
+    initial_angles = rng.uniform(0, 2 * np.pi, size=batch_shape + (1,))
+    turns = rng.normal(0, angle_jitter, size=batch_shape + (num_steps,))
+    angles = (initial_angles + np.cumsum(turns, axis=-1)).astype(np.float32)
+    lengths = rng.uniform(*step_lengths, size=batch_shape + (num_steps,)).astype(np.float32)
+    steps = np.stack([np.sin(angles) * lengths, np.cos(angles) * lengths], axis=-1)
+    return np.concatenate([starts[..., None, :], starts[..., None, :] + np.cumsum(steps, axis=-2)], axis=-2)
+
+
+def _scatter_polylines(canvas: np.ndarray, polylines: np.ndarray, height: int, width: int):
+    """
+    Sets the pixels along polylines (N, K, V, 2) in `canvas`, the flattened (N, height, width) masks
+    plus one trailing element that absorbs every point outside the image. Each segment is sampled
+    densely enough that consecutive points touch, all segments of the batch at once.
+    """
+    num_masks = polylines.shape[0]
+    index_dtype, unsigned_dtype = (np.int32, np.uint32) if canvas.size < 2 ** 31 else (np.int64, np.uint64)
+    polylines = polylines.astype(np.float32)
+    ys, xs = polylines[..., 0], polylines[..., 1]
+    dys, dxs = np.diff(ys, axis=-1), np.diff(xs, axis=-1)
+    num_samples = int(np.ceil(max(np.abs(dys).max(initial=1.0), np.abs(dxs).max(initial=1.0)))) + 1
+    t = np.linspace(0.0, 1.0, num_samples, dtype=np.float32)
+    point_ys = np.rint(ys[..., :-1, None] + dys[..., None] * t).astype(index_dtype).reshape(num_masks, -1)
+    point_xs = np.rint(xs[..., :-1, None] + dxs[..., None] * t).astype(index_dtype).reshape(num_masks, -1)
+
+    # Viewed as unsigned, negative coordinates become huge, so one comparison per axis finds them too.
+    outside = (point_ys.view(unsigned_dtype) >= height) | (point_xs.view(unsigned_dtype) >= width)
+    flat_idx = (np.arange(num_masks, dtype=index_dtype)[:, None] * height + point_ys) * width + point_xs
+    flat_idx[outside] = canvas.size - 1
+    canvas[flat_idx.ravel()] = True
+
+
+def _draw_polylines(polyline_sets: list, radii: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    Rasterizes one or more sets of polylines (N, K, V, 2), which may differ in K and V, into N
+    masks and dilates each mask to its brush radius from `radii` (N,).
+    """
+    num_masks = len(radii)
+    canvas = np.zeros(num_masks * height * width + 1, dtype=bool)
+    for polylines in polyline_sets:
+        _scatter_polylines(canvas, polylines, height, width)
+    return _box_dilate(canvas[:-1].reshape(num_masks, height, width), radii)
+
+
+@register_mask_strategy("random_rectangle")
+def random_rectangle(rng: np.random.Generator, num_masks: int, height: int, width: int, config: dict) -> np.ndarray:
+    """One axis-aligned rectangle per mask, with sides between the min and max size ratios."""
+    inside_rows, inside_cols = _rectangles(rng, num_masks, height, width, config)
+    return inside_rows[:, :, None] & inside_cols[:, None, :]
+
+
+@register_mask_strategy("multi_rectangle")
+def multi_rectangle(rng: np.random.Generator, num_masks: int, height: int, width: int, config: dict) -> np.ndarray:
+    """Between 1 and `max_rectangles` possibly overlapping rectangles per mask."""
+    max_rectangles = config.get("max_rectangles", 4)
+    rectangle_counts = _integers(rng, 1, max_rectangles, num_masks)
+    masks = np.zeros((num_masks, height, width), dtype=bool)
+    for k in range(max_rectangles):
+        inside_rows, inside_cols = _rectangles(rng, num_masks, height, width, config)
+        inside_rows &= (rectangle_counts > k)[:, None]
+        masks |= inside_rows[:, :, None] & inside_cols[:, None, :]
+    return masks
+
+
+@register_mask_strategy("brush_stroke")
+def brush_stroke(rng: np.random.Generator, num_masks: int, height: int, width: int, config: dict) -> np.ndarray:
+    """Free-form strokes: smooth random walks drawn with a thick brush, as in free-form inpainting masks."""
+    size = min(height, width)
+    num_strokes = config.get("num_strokes", 4)
+    num_vertices = config.get("stroke_vertices", 6)
+    starts = rng.uniform([0, 0], [height, width], size=(num_masks, num_strokes, 2))
+    strokes = _random_walks(
+        rng, starts, num_vertices, (0.05 * size, config.get("max_stroke_length_ratio", 0.15) * size), angle_jitter=0.6
+    )
+    radii = _integers(
+        rng, max(1, int(config.get("min_brush_width_ratio", 0.02) * size / 2)),
+        max(1, int(config.get("max_brush_width_ratio", 0.06) * size / 2)), num_masks
+    )
+    return _draw_polylines([strokes], radii, height, width)
+
+
+@register_mask_strategy("crack")
+def crack(rng: np.random.Generator, num_masks: int, height: int, width: int, config: dict) -> np.ndarray:
+    """
+    Thin, jagged, branching lines resembling fractures across a pottery surface: long random walks
+    with sharp turns and short steps, plus side branches starting from points on each crack.
+    """
+    size = min(height, width)
+    num_cracks = config.get("num_cracks", 2)
+    num_steps = config.get("crack_steps", 24)
+    step_lengths = (0.01 * size, 0.04 * size)
+    max_radius = max(1, int(config.get("max_crack_width_ratio", 0.01) * size / 2))
+
+    starts = rng.uniform([0, 0], [height, width], size=(num_masks, num_cracks, 2))
+    cracks = _random_walks(rng, starts, num_steps, step_lengths, angle_jitter=0.5)
+    branch_origins = _integers(rng, 1, num_steps, (num_masks, num_cracks))
+    branch_starts = np.take_along_axis(cracks, branch_origins[..., None, None], axis=2)[:, :, 0]
+    branches = _random_walks(rng, branch_starts, num_steps // 2, step_lengths, angle_jitter=0.5)
+
+    radii = _integers(rng, 0, max_radius, num_masks)
+    return _draw_polylines([cracks, branches], radii, height, width)
+
+
+@register_mask_strategy("edge_biased")
+def edge_biased(rng: np.random.Generator, num_masks: int, height: int, width: int, config: dict) -> np.ndarray:
+    """
+    Irregular regions attached to one image border, like chipped rims and broken edges. Along a
+    random span of the chosen border, the region reaches inwards to a depth that varies smoothly
+    between the min and max size ratios.
+    """
+    min_ratio, max_ratio = config["min_mask_size_ratio"], config["max_mask_size_ratio"]
+    size = min(height, width)
+    length = max(height, width)
+    sides = rng.integers(0, 4, size=num_masks)  # top, bottom, left, right
+
+    # Smooth depth profile along the border: a base depth plus two random low-frequency sinusoids.
+    positions = np.arange(length)[None, :] / length
+    base = rng.uniform(min_ratio, max_ratio, size=(num_masks, 1)) * size
+    frequencies = rng.uniform(1.0, 6.0, size=(num_masks, 2))
+    phases = rng.uniform(0, 2 * np.pi, size=(num_masks, 2))
+    amplitude = 0.25 * base
+    profile = base + amplitude * (np.sin(2 * np.pi * frequencies[:, :1] * positions + phases[:, :1])
+                                  + np.sin(2 * np.pi * frequencies[:, 1:] * positions + phases[:, 1:])) / 2
+
+    edge_lengths = np.where(sides < 2, width, height)
+    span_lengths = (rng.uniform(2 * min_ratio, 2 * max_ratio, size=num_masks).clip(max=1.0) * edge_lengths).astype(np.int64)
+    span_starts = _integers(rng, 0, edge_lengths - span_lengths, num_masks)
+    along = np.arange(length)[None, :]
+    in_span = (along >= span_starts[:, None]) & (along < (span_starts + span_lengths)[:, None])
+
+    # Regions are built against the top (or left) border and flipped for the bottom (or right) one.
+    masks = np.empty((num_masks, height, width), dtype=bool)
+    ys, xs = np.arange(height), np.arange(width)
+    for side, flip_axis in enumerate([None, 1, None, 2]):
+        group = sides == side
+        if side < 2:
+            region = (ys[None, :, None] < profile[group, None, :width]) & in_span[group, None, :width]
+        else:
+            region = (xs[None, None, :] < profile[group, :height, None]) & in_span[group, :height, None]
+        masks[group] = region if flip_axis is None else np.flip(region, axis=flip_axis)
+    return masks
+
+def generate_masks(strategy_name: str, rng: np.random.Generator, num_masks: int, height: int, width: int,
+                   config: dict, batch_size: int = 1024) -> np.ndarray:
+    """
+    Generates `num_masks` masks with a registered strategy, `batch_size` at a time to bound the
+    size of intermediate arrays. Returns uint8 masks of shape (N, height, width), 255 where masked.
+    """
+    if strategy_name not in MASK_STRATEGIES:
+        raise ValueError(f"Unknown masking strategy: {strategy_name}. Available: {sorted(MASK_STRATEGIES)}")
+    strategy = MASK_STRATEGIES[strategy_name]
+    masks = np.empty((num_masks, height, width), dtype=np.uint8)
+    for start in range(0, num_masks, batch_size):
+        count = min(batch_size, num_masks - start)
+        # Multiplying the bool masks viewed as uint8 stays in the fast uint8 loop; bool * int casts per element.
+        np.multiply(strategy(rng, count, height, width, config).view(np.uint8), np.uint8(255), out=masks[start:start + count])
+    return masks
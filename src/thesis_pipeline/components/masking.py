@@ -1,73 +1,193 @@
 # src/thesis_pipeline/components/masking.py
+import io
+import os
 import logging
-import shutil
 import numpy as np
+import torch
 from PIL import Image
 from pathlib import Path
 from tqdm import tqdm
-import random
+from concurrent.futures import ThreadPoolExecutor
+from thesis_pipeline.utils.common import link_or_copy
+from thesis_pipeline.components.packed_dataset import PackedShardWriter
+from thesis_pipeline.components.mask_strategies import MASK_STRATEGIES, generate_masks
+from thesis_pipeline.components.image_headers import read_image_size
+from thesis_pipeline.components.metadata_store import ImageMetadataStore, normalize_path
+
+# Index of the loose-file samples (filename, split, image, mask; paths relative to the dataset root)
+INPAINTING_MANIFEST_FILENAME = "inpainting_manifest.csv"
+
+
+def generate_random_rectangle_masks(batch_size: int, height: int, width: int, min_ratio: float, max_ratio: float,
+                                    generator: torch.Generator, device=None) -> torch.Tensor:
+    """
+    Generates a batch of single-rectangle masks as one tensor operation, with the same size
+    distribution as the 'random_rectangle' mask strategy. Returns a float tensor of
+    shape (batch_size, 1, height, width) with 1 inside the rectangle and 0 elsewhere.
+    """
+    def random_ints(low: torch.Tensor, high: torch.Tensor) -> torch.Tensor:
+        # Uniform integers in [low, high] with per-sample bounds.
+        uniform = torch.rand(batch_size, generator=generator, device=device)
+        return low + (uniform * (high - low + 1)).long().clamp(max=high - low)
+
+    def bounds(extent: int) -> tuple:
+        low = torch.full((batch_size,), int(min_ratio * extent), device=device, dtype=torch.long)
+        high = torch.full((batch_size,), int(max_ratio * extent), device=device, dtype=torch.long)
+        return low, high
+
+    mask_heights = random_ints(*bounds(height))
+    mask_widths = random_ints(*bounds(width))
+    zeros = torch.zeros(batch_size, device=device, dtype=torch.long)
+    tops = random_ints(zeros, height - mask_heights)
+    lefts = random_ints(zeros, width - mask_widths)
+
+    rows = torch.arange(height, device=device)[None, :]
+    cols = torch.arange(width, device=device)[None, :]
+    inside_rows = (rows >= tops[:, None]) & (rows < (tops + mask_heights)[:, None])
+    inside_cols = (cols >= lefts[:, None]) & (cols < (lefts + mask_widths)[:, None])
+    return (inside_rows[:, :, None] & inside_cols[:, None, :]).unsqueeze(1).float()
+
 
 class MaskingStrategy:
     """
     Encapsulates strategies for generating image masks and creating inpainting datasets.
+    Masks come from the batched generators registered in `mask_strategies.MASK_STRATEGIES`,
+    drawn from a numpy Generator seeded with `seed` (an int or a sequence of ints) so datasets
+    are reproducible.
     """
-    def __init__(self, strategy_name: str, mask_config: dict):
+    def __init__(self, strategy_name: str, mask_config: dict, seed: int = None, num_workers: int = 1,
+                 metadata_store: ImageMetadataStore = None):
+        self.strategy_name = strategy_name
         self.mask_config = mask_config
+        # 0 means "use every core"; mask encoding (zlib) and file I/O release the GIL, so threads scale
+        self.num_workers = num_workers if num_workers > 0 else os.cpu_count()
+        self.rng = np.random.default_rng(seed)
+        self.metadata_store = metadata_store
         self.logger = logging.getLogger(__name__)
-        
-        if strategy_name == "random_rectangle":
-            self.mask_generator = self._generate_random_rectangle_mask
-        else:
+
+        if strategy_name not in MASK_STRATEGIES:
             self.logger.error(f"Unknown masking strategy: {strategy_name}")
-            raise ValueError(f"Unknown masking strategy: {strategy_name}")
+            raise ValueError(f"Unknown masking strategy: {strategy_name}. Available: {sorted(MASK_STRATEGIES)}")
 
-    def _generate_random_rectangle_mask(self, height: int, width: int) -> np.ndarray:
-        """Generates a mask with a single random rectangle."""
-        mask = np.zeros((height, width), dtype=np.uint8)
-        min_ratio = self.mask_config['min_mask_size_ratio']
-        max_ratio = self.mask_config['max_mask_size_ratio']
+    def generate_masks(self, num_masks: int, height: int, width: int) -> np.ndarray:
+        """Generates a batch of uint8 masks of shape (num_masks, height, width), 255 where masked."""
+        return generate_masks(self.strategy_name, self.rng, num_masks, height, width, self.mask_config)
 
-        mask_height = random.randint(int(min_ratio * height), int(max_ratio * height))
-        mask_width = random.randint(int(min_ratio * width), int(max_ratio * width))
+    def mask_generator(self, height: int, width: int) -> np.ndarray:
+        """Generates a single mask."""
+        return self.generate_masks(1, height, width)[0]
 
-        top = random.randint(0, height - mask_height)
-        left = random.randint(0, width - mask_width)
+    def _iter_mask_batches(self, image_files: list, batch_size: int = 256):
+        """
+        Yields lists of (image path, mask) for every readable image, `batch_size` images at a time.
+        Sizes come from the metadata store when it has a current entry, otherwise from the image
+        headers; masks are generated one batch per distinct size.
+        """
+        for start in range(0, len(image_files), batch_size):
+            chunk = image_files[start:start + batch_size]
+            known_sizes = {}
+            if self.metadata_store is not None:
+                known = self.metadata_store.lookup(chunk)
+                known_sizes = dict(zip(known["path"], zip(known["width"].astype(int), known["height"].astype(int))))
+            paths_by_size = {}
+            for img_path in chunk:
+                try:
+                    size = known_sizes.get(normalize_path(img_path)) or read_image_size(img_path)
+                    paths_by_size.setdefault(size, []).append(img_path)
+                except Exception as e:
+                    self.logger.error(f"Failed to read the size of {img_path}. Error: {e}")
 
-        mask[top:top + mask_height, left:left + mask_width] = 255
-        return mask
+            masks = {}
+            for (width, height), paths in paths_by_size.items():
+                masks.update(zip(paths, self.generate_masks(len(paths), height, width)))
+            yield [(img_path, masks[img_path]) for img_path in chunk if img_path in masks]
 
-    def create_inpainting_dataset(self, image_dir: Path, output_dir: Path):
+    def _map_samples(self, func, image_files: list, desc: str):
+        """
+        Applies `func(img_path, mask)` to every image on the worker pool, in order. Masks are still
+        generated in the calling thread, so the output does not depend on the number of workers.
+        Yields (image path, result or None, error or None).
+        """
+        def run(sample):
+            img_path, mask_array = sample
+            try:
+                return img_path, func(img_path, mask_array), None
+            except Exception as e:
+                return img_path, None, e
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor, tqdm(total=len(image_files), desc=desc) as progress:
+            for batch in self._iter_mask_batches(image_files):
+                for result in executor.map(run, batch):
+                    progress.update(1)
+                    yield result
+
+    def create_inpainting_dataset(self, image_dir: Path, output_dir: Path, image_files: list = None) -> list:
         """
         Creates a dataset for inpainting by generating masks for a set of images.
-        Original images are copied to a 'ground_truth' sub-directory and masks
-        are saved in a 'masks' sub-directory.
+        Original images are placed in a 'ground_truth' sub-directory (hard-linked or reflinked where
+        the filesystem allows, copied otherwise) and masks are saved in a 'masks' sub-directory.
+        `image_files` (e.g. from the split manifest) replaces the listing of `image_dir`.
+        Returns the filenames of the samples written.
         """
-        image_files = [p for p in image_dir.glob('*.png') if p.is_file()]
-        
+        if image_files is None:
+            image_files = sorted(p for p in image_dir.glob('*.png') if p.is_file())
+
         if not image_files:
-            self.logger.warning(f"No PNG images found in {image_dir}. Nothing to process.")
-            return
+            self.logger.warning(f"No images found for the {output_dir.name} split. Nothing to process.")
+            return []
 
         ground_truth_dir = output_dir / "ground_truth"
         masks_dir = output_dir / "masks"
         ground_truth_dir.mkdir(parents=True, exist_ok=True)
         masks_dir.mkdir(parents=True, exist_ok=True)
 
-        self.logger.info(f"Generating masks for {len(image_files)} images from {image_dir.name} split...")
+        self.logger.info(f"Generating masks for {len(image_files)} images from {output_dir.name} split ({self.num_workers} workers)...")
 
-        for img_path in tqdm(image_files, desc=f"Generating masks for {image_dir.name}"):
-            try:
-                shutil.copy(img_path, ground_truth_dir / img_path.name)
+        def write_sample(img_path: Path, mask_array: np.ndarray) -> str:
+            link_method = link_or_copy(img_path, ground_truth_dir / img_path.name)
+            # Masks are always PNG-encoded, so JPEG-format datasets do not get lossy mask edges.
+            Image.fromarray(mask_array, mode='L').save(masks_dir / img_path.name, format="PNG")
+            return link_method
+
+        link_counts = {}
+        written = []
+        for img_path, link_method, error in self._map_samples(write_sample, image_files, f"Generating masks for {output_dir.name}"):
+            if error is not None:
+                self.logger.error(f"Failed to process or generate mask for {img_path}. Error: {error}")
+                continue
+            link_counts[link_method] = link_counts.get(link_method, 0) + 1
+            written.append(img_path.name)
 
-                with Image.open(img_path) as img:
-                    width, height = img.size
+        self.logger.info(f"Finished generating masks for the {output_dir.name} split. Ground truth files: {link_counts}")
+        return written
 
-                mask_array = self.mask_generator(height, width)
-                mask_image = Image.fromarray(mask_array, mode='L')
+    def create_packed_inpainting_dataset(self, image_dir: Path, output_dir: Path, shard_size: int, image_files: list = None):
+        """
+        Same as `create_inpainting_dataset`, but writes ground truth and mask pairs into tar shards
+        under a 'packed' sub-directory instead of thousands of loose files. The processed PNG bytes
+        are stored as-is, so images are not re-encoded. Masks are encoded on the worker pool and
+        appended to the shards in order. `image_files` replaces the listing of `image_dir`.
+        """
+        if image_files is None:
+            image_files = sorted(p for p in image_dir.glob('*.png') if p.is_file())
 
-                mask_image.save(masks_dir / img_path.name)
+        if not image_files:
+            self.logger.warning(f"No images found for the {output_dir.name} split. Nothing to process.")
+            return
 
-            except Exception as e:
-                self.logger.error(f"Failed to process or generate mask for {img_path}. Error: {e}")
+        writer = PackedShardWriter(output_dir / "packed", shard_size)
+        self.logger.info(f"Generating packed masks for {len(image_files)} images from {output_dir.name} split ({self.num_workers} workers)...")
+
+        def encode_sample(img_path: Path, mask_array: np.ndarray) -> tuple:
+            mask_buffer = io.BytesIO()
+            Image.fromarray(mask_array, mode='L').save(mask_buffer, format="PNG")
+            return img_path.read_bytes(), mask_buffer.getvalue()
+
+        for img_path, encoded, error in self._map_samples(encode_sample, image_files, f"Packing {output_dir.name}"):
+            if error is not None:
+                self.logger.error(f"Failed to process or generate mask for {img_path}. Error: {error}")
+                continue
+            writer.add(img_path.stem, *encoded)
 
-        self.logger.info(f"Finished generating masks for the {image_dir.name} split.")
+        writer.close()
+        self.logger.info(f"Finished packing the {output_dir.name} split.")
@@ -0,0 +1,125 @@
+# src/thesis_pipeline/components/metadata_store.py
+import os
+import sqlite3
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from thesis_pipeline.components.image_quality import QUALITY_COLUMNS
+
+# Column name -> SQLite type. New columns are added to existing stores on open.
+METADATA_COLUMNS = {
+    "path": "TEXT PRIMARY KEY",
+    "filename": "TEXT",
+    "mtime_ns": "INTEGER",
+    "size_bytes": "INTEGER",
+    "width": "INTEGER",
+    "height": "INTEGER",
+    "mode": "TEXT",
+    **{column: "REAL" for column in QUALITY_COLUMNS},
+}
+
+
+def normalize_path(path) -> str:
+    """Store key of a file: its absolute path, so runs from different working directories agree."""
+    return os.path.abspath(path)
+
+
+class ImageMetadataStore:
+    """
+    Persistent per-image metadata in a SQLite table keyed by absolute path. Each row also records
+    the file's mtime and size at analysis time, so callers only re-analyze new or changed files
+    and can trust a row only while the file on disk still matches it.
+    Connections are opened per call, so the store can be shared between stages and threads.
+    """
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.logger = logging.getLogger(__name__)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = ", ".join(f"{name} {sql_type}" for name, sql_type in METADATA_COLUMNS.items())
+            conn.execute(f"CREATE TABLE IF NOT EXISTS images ({columns})")
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(images)")}
+            for name, sql_type in METADATA_COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE images ADD COLUMN {name} {sql_type}")
+
+    @contextmanager
+    def _connect(self):
+        """Yields a connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.db_path, timeout=30.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def find_stale(self, scan: pd.DataFrame, required_columns: list = ()) -> pd.DataFrame:
+        """
+        Given a scan with columns (path, mtime_ns, size_bytes), returns the rows of files that are
+        not in the store, whose mtime or size changed since they were analyzed, or that are missing
+        any of `required_columns` (e.g. rows written before those columns existed).
+        """
+        required_columns = list(required_columns)
+        with self._connect() as conn:
+            stored = pd.read_sql_query(f"SELECT {', '.join(['path', 'mtime_ns', 'size_bytes'] + required_columns)} FROM images", conn)
+        merged = scan.merge(stored, on="path", how="left", suffixes=("", "_stored"))
+        stale = (merged["mtime_ns"] != merged["mtime_ns_stored"]) | (merged["size_bytes"] != merged["size_bytes_stored"])
+        if required_columns:
+            stale |= merged[required_columns].isna().any(axis=1)
+        return scan[stale.to_numpy()]
+
+    def upsert(self, records: pd.DataFrame):
+        """Inserts or replaces rows; `records` needs the 'path' column plus any metadata columns."""
+        if records.empty:
+            return
+        columns = [c for c in records.columns if c in METADATA_COLUMNS]
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != "path")
+        rows = records[columns].astype(object).where(records[columns].notna(), None).itertuples(index=False, name=None)
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO images ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT(path) DO UPDATE SET {updates}",
+                rows
+            )
+
+    def prune(self, root: Path, present_paths: list) -> int:
+        """Deletes rows under `root` whose files are no longer present. Returns the number removed."""
+        stored = self.query(root)["path"]
+        missing = stored[~stored.isin(list(present_paths))].tolist()
+        if missing:
+            with self._connect() as conn:
+                conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in missing])
+        return len(missing)
+
+    def query(self, root: Path = None) -> pd.DataFrame:
+        """Returns all rows, or only those of files under `root`."""
+        with self._connect() as conn:
+            if root is None:
+                return pd.read_sql_query("SELECT * FROM images ORDER BY path", conn)
+            prefix = os.path.join(normalize_path(root), "")
+            return pd.read_sql_query(
+                "SELECT * FROM images WHERE substr(path, 1, ?) = ? ORDER BY path", conn, params=(len(prefix), prefix)
+            )
+
+    def lookup(self, paths: list) -> pd.DataFrame:
+        """
+        Returns the rows of `paths` that are still current: one `stat` per file is compared against
+        the stored mtime and size, which is far cheaper than opening the image again.
+        """
+        scan = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            scan.append((normalize_path(path), stat.st_mtime_ns, stat.st_size))
+        if not scan:
+            return pd.DataFrame(columns=list(METADATA_COLUMNS))
+        scan = pd.DataFrame(scan, columns=["path", "mtime_ns", "size_bytes"])
+        with self._connect() as conn:
+            conn.execute("CREATE TEMP TABLE lookup (path TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO lookup VALUES (?)", ((p,) for p in scan["path"]))
+            stored = pd.read_sql_query("SELECT images.* FROM images JOIN lookup USING (path)", conn)
+        return stored.merge(scan, on=["path", "mtime_ns", "size_bytes"], how="inner")
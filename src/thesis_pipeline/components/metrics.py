@@ -0,0 +1,120 @@
+# src/thesis_pipeline/components/metrics.py
+import logging
+import numpy as np
+import torch
+import torch.nn.functional as F
+from concurrent.futures import ThreadPoolExecutor
+
+# ==============================================================================
+# Batched Image Quality Metrics
+# ==============================================================================
+# PSNR and SSIM on batches of images as torch tensors, with masked-region-only
+# variants. SSIM uses the same formulation as `skimage.metrics.structural_similarity`
+# with its defaults (7x7 uniform window, sample covariance, K1=0.01, K2=0.03,
+# borders excluded, averaged over channels), so scores stay comparable with the
+# earlier per-image skimage results.
+
+SSIM_WINDOW = 7
+SSIM_K1, SSIM_K2 = 0.01, 0.03
+METRIC_NAMES = ["psnr", "ssim", "masked_psnr", "masked_ssim"]
+
+
+def _to_tensor(images: np.ndarray) -> torch.Tensor:
+    """(N, H, W, C) uint8 images -> (N, C, H, W) float64 tensor."""
+    return torch.from_numpy(np.ascontiguousarray(images)).permute(0, 3, 1, 2).to(torch.float64)
+
+
+def _window_mean(x: torch.Tensor, window: int) -> torch.Tensor:
+    """
+    Mean over every window x window patch of each channel (valid positions only). The uniform
+    window is separable, so it is applied as a vertical then a horizontal pass.
+    """
+    return F.avg_pool2d(F.avg_pool2d(x, (window, 1), stride=1), (1, window), stride=1)
+
+
+def ssim_map(x: torch.Tensor, y: torch.Tensor, data_range: float, window: int = SSIM_WINDOW) -> torch.Tensor:
+    """
+    Per-pixel SSIM of (N, C, H, W) batches, for every position whose window lies inside the image.
+    Returns (N, C, H - window + 1, W - window + 1).
+    """
+    covariance_norm = window ** 2 / (window ** 2 - 1)  # Sample covariance, as in skimage
+    c1, c2 = (SSIM_K1 * data_range) ** 2, (SSIM_K2 * data_range) ** 2
+    mu_x, mu_y = _window_mean(x, window), _window_mean(y, window)
+    var_x = covariance_norm * (_window_mean(x * x, window) - mu_x * mu_x)
+    var_y = covariance_norm * (_window_mean(y * y, window) - mu_y * mu_y)
+    cov_xy = covariance_norm * (_window_mean(x * y, window) - mu_x * mu_y)
+    return ((2 * mu_x * mu_y + c1) * (2 * cov_xy + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+
+
+def _psnr_from_mse(mse: torch.Tensor, data_range: float) -> torch.Tensor:
+    return 10 * torch.log10(data_range ** 2 / mse)
+
+
+def compute_batch_metrics(originals: np.ndarray, restored: np.ndarray, masks: np.ndarray,
+                          data_range: float = 255.0, device: str = "cpu") -> dict:
+    """
+    Metrics of a batch: `originals` and `restored` are (N, H, W, 3) uint8 and `masks` (N, H, W) bool,
+    True where the image was masked out and inpainted. Returns a dict of (N,) arrays keyed by
+    METRIC_NAMES. The masked variants only count masked pixels (for SSIM, window centres inside the
+    mask), so they are not inflated by the unchanged rest of the image; they are NaN for empty masks.
+    """
+    x, y = _to_tensor(originals).to(device), _to_tensor(restored).to(device)
+    mask = torch.from_numpy(np.ascontiguousarray(masks)).to(device)[:, None].to(torch.float64)
+
+    squared_error = (x - y) ** 2
+    mse = squared_error.mean(dim=(1, 2, 3))
+    masked_pixels = mask.sum(dim=(1, 2, 3)) * x.shape[1]
+    masked_mse = (squared_error * mask).sum(dim=(1, 2, 3)) / masked_pixels
+
+    ssim_values = ssim_map(x, y, data_range)
+    pad = (SSIM_WINDOW - 1) // 2
+    ssim_mask = mask[:, :, pad:mask.shape[2] - pad, pad:mask.shape[3] - pad]
+    masked_ssim = (ssim_values * ssim_mask).sum(dim=(1, 2, 3)) / (ssim_mask.sum(dim=(1, 2, 3)) * x.shape[1])
+
+    return {
+        "psnr": _psnr_from_mse(mse, data_range).cpu().numpy(),
+        "ssim": ssim_values.mean(dim=(1, 2, 3)).cpu().numpy(),
+        "masked_psnr": _psnr_from_mse(masked_mse, data_range).cpu().numpy(),
+        "masked_ssim": masked_ssim.cpu().numpy(),
+    }
+
+
+class MetricsEngine:
+    """
+    Computes metrics of submitted batches on a background thread pool, so they overlap with the
+    generation of the next batch (torch releases the GIL inside its kernels). Results are returned
+    in submission order by `collect`.
+    """
+    def __init__(self, num_workers: int = 1, device: str = "cpu"):
+        self.device = device
+        self.executor = ThreadPoolExecutor(max_workers=max(1, num_workers))
+        self.pending = []
+        self.logger = logging.getLogger(__name__)
+
+    def submit(self, samples: list, originals: np.ndarray, restored: np.ndarray, masks: np.ndarray):
+        """
+        Queues a batch. `samples` holds one dict per image (e.g. its filename) that its metrics are
+        added to. The arrays must not be modified afterwards.
+        """
+        future = self.executor.submit(compute_batch_metrics, originals, restored, masks, device=self.device)
+        self.pending.append((samples, future))
+
+    def collect(self, wait: bool = True) -> list:
+        """
+        Returns one record per image, the sample dict plus METRIC_NAMES, in submission order. Waits
+        for every queued batch, or with `wait=False` only takes the leading batches already finished.
+        """
+        records = []
+        while self.pending and (wait or self.pending[0][1].done()):
+            samples, future = self.pending.pop(0)
+            try:
+                metrics = future.result()
+            except Exception as e:
+                self.logger.error(f"Failed to compute metrics for {[s.get('filename') for s in samples]}. Error: {e}")
+                continue
+            for i, sample in enumerate(samples):
+                records.append({**sample, **{name: float(metrics[name][i]) for name in METRIC_NAMES}})
+        return records
+
+    def close(self):
+        self.executor.shutdown(wait=True)
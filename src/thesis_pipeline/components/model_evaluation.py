@@ -1,4 +1,7 @@
 # src/thesis_pipeline/components/model_evaluation.py
+import re
+import time
+import multiprocessing
 import logging
 import torch
 import numpy as np
@@ -6,97 +9,312 @@ from PIL import Image
 from pathlib import Path
 from tqdm import tqdm
 import pandas as pd
-from skimage.metrics import peak_signal_noise_ratio as psnr
-from skimage.metrics import structural_similarity as ssim
-from diffusers import StableDiffusionInpaintingPipeline
+from concurrent.futures import ProcessPoolExecutor
+from safetensors.torch import load_file
+from thesis_pipeline.components.metrics import MetricsEngine, METRIC_NAMES
+from thesis_pipeline.components.comparison_writer import ComparisonImageWriter
+from thesis_pipeline.utils.common import load_json, save_json
+from diffusers import StableDiffusionInpaintPipeline, UNet2DConditionModel
+
+BASE_SEED = 0 # Sample i of the sorted test set is generated with seed BASE_SEED + i
+FINAL_CHECKPOINT = "unet_final"
+UNET_WEIGHTS_NAME = "diffusion_pytorch_model.safetensors"
+SWEEP_METRICS_FILENAME = "checkpoint_sweep_metrics.csv"
+SHARD_DIRNAME = "shards"
 
 class ModelEvaluator:
+    """
+    Inpaints the test set with the fine-tuned UNet and scores the results. Samples are fed to the
+    pipeline `batch_size` at a time, each with its own generator seeded from its index, so the
+    results do not depend on the batch size or on which other samples share a batch.
+    With `sweep_checkpoints`, every saved checkpoint is evaluated with one pipeline: the VAE, text
+    encoder and scheduler are loaded once and only the UNet weights are swapped in per checkpoint.
+    Metrics are written per shard of the test set as they are computed, so interrupted runs resume;
+    shards computed with other weights, samples or settings are re-evaluated.
+    """
     def __init__(self, config, test_data_dir: Path):
         self.config = config
         self.test_data_dir = test_data_dir
         self.device = config.device
+        self.batch_size = config.get("batch_size", 1)
+        self.metrics_workers = config.get("metrics_workers", 1)
+        self.sweep_checkpoints = config.get("sweep_checkpoints", False)
+        self.num_shards = config.get("num_shards", 1)
+        self.shard_index = config.get("shard_index")
         self.output_dir = Path(config.output_dir)
         self.logger = logging.getLogger(__name__)
+        self.null_prompt_embeds = None
 
-    def _load_pipeline(self):
+    def _load_pipeline(self, checkpoint_dir: Path):
         """Loads the trained model into an inpainting pipeline."""
         try:
-            model_path = Path(self.config.trained_model_dir) / "unet_final"
-            pipeline = StableDiffusionInpaintingPipeline.from_pretrained(
-                "runwayml/stable-diffusion-inpainting",
-                unet=model_path,
-                device_map=self.device,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            )
-            self.logger.info(f"Successfully loaded pipeline with UNet from: {model_path}")
+            torch_dtype = torch.float16 if self.device == "cuda" else torch.float32
+            unet = UNet2DConditionModel.from_pretrained(checkpoint_dir, torch_dtype=torch_dtype)
+            pipeline = StableDiffusionInpaintPipeline.from_pretrained(
+                self.config.base_model_id,
+                unet=unet,
+                torch_dtype=torch_dtype,
+            ).to(self.device)
+            pipeline.set_progress_bar_config(disable=True)
+            self.logger.info(f"Successfully loaded pipeline with UNet from: {checkpoint_dir}")
             return pipeline
         except Exception as e:
             self.logger.error(f"Failed to load the inpainting pipeline. Error: {e}")
             raise
 
-    def evaluate(self):
-        """Runs the full evaluation process."""
-        pipeline = self._load_pipeline()
-        
-        image_dir = self.test_data_dir / 'ground_truth'
-        mask_dir = self.test_data_dir / 'masks'
+    def _swap_unet(self, pipeline, checkpoint_dir: Path):
+        """Copies the weights of another checkpoint into the pipeline's UNet in place."""
+        state_dict = load_file(checkpoint_dir / UNET_WEIGHTS_NAME, device=str(pipeline.unet.device))
+        pipeline.unet.load_state_dict(state_dict)
+        self.logger.info(f"Swapped in UNet weights from: {checkpoint_dir}")
 
-        image_files = sorted([p for p in image_dir.glob('*.png') if p.is_file()])
-        mask_files = sorted([p for p in mask_dir.glob('*.png') if p.is_file()])
-
-        if not image_files or not mask_files:
-            self.logger.warning("Test data not found. Skipping evaluation.")
-            return
+    def _find_checkpoints(self) -> list:
+        """`unet_final` alone, or with `sweep_checkpoints` every `unet_epoch_N` by epoch followed by `unet_final`."""
+        model_dir = Path(self.config.trained_model_dir)
+        if not self.sweep_checkpoints:
+            return [model_dir / FINAL_CHECKPOINT]
+        epochs = [(int(m.group(1)), p) for p in model_dir.glob("unet_epoch_*") if (m := re.fullmatch(r"unet_epoch_(\d+)", p.name))]
+        checkpoints = [p for _, p in sorted(epochs)]
+        if (model_dir / FINAL_CHECKPOINT).exists():
+            checkpoints.append(model_dir / FINAL_CHECKPOINT)
+        return checkpoints
 
+    def _find_samples(self) -> list:
+        """(image, mask) path pairs of the test set, sorted and limited to `num_samples_to_evaluate`."""
+        image_files = sorted([p for p in (self.test_data_dir / 'ground_truth').glob('*.png') if p.is_file()])
+        mask_files = sorted([p for p in (self.test_data_dir / 'masks').glob('*.png') if p.is_file()])
         num_samples = self.config.num_samples_to_evaluate
         if num_samples > 0 and num_samples < len(image_files):
             image_files = image_files[:num_samples]
             mask_files = mask_files[:num_samples]
-        
-        self.logger.info(f"Evaluating on {len(image_files)} samples.")
-        self.output_dir.mkdir(parents=True, exist_ok=True)
-        comparison_dir = self.output_dir / "comparisons"
-        comparison_dir.mkdir(exist_ok=True)
+        return list(zip(image_files, mask_files))
 
-        results = []
-        generator = torch.Generator(device=self.device).manual_seed(0)
+    @torch.no_grad()
+    def _encode_null_prompt(self, pipeline) -> torch.Tensor:
+        """Text embedding of the empty prompt, computed once; it is the same for every checkpoint."""
+        if self.null_prompt_embeds is None:
+            self.null_prompt_embeds, _ = pipeline.encode_prompt(
+                "", device=pipeline.device, num_images_per_prompt=1, do_classifier_free_guidance=False
+            )
+        return self.null_prompt_embeds
 
-        for img_path, mask_path in tqdm(zip(image_files, mask_files), total=len(image_files), desc="Evaluating"):
-            try:
-                original_image = Image.open(img_path).convert("RGB")
-                mask_image = Image.open(mask_path).convert("RGB")
-
-                with torch.no_grad():
-                    restored_image = pipeline(
-                        prompt="", image=original_image, mask_image=mask_image,
-                        num_inference_steps=self.config.num_inference_steps,
-                        generator=generator,
-                    ).images[0]
-
-                original_np = np.array(original_image)
-                restored_np = np.array(restored_image)
-                
-                current_psnr = psnr(original_np, restored_np, data_range=255)
-                current_ssim = ssim(original_np, restored_np, data_range=255, channel_axis=2)
-                results.append({'filename': img_path.name, 'psnr': current_psnr, 'ssim': current_ssim})
-
-                masked_image = Image.fromarray(original_np * (np.array(mask_image) < 128))
-                comparison_img = Image.new('RGB', (original_image.width * 3, original_image.height))
-                comparison_img.paste(original_image, (0, 0))
-                comparison_img.paste(masked_image, (original_image.width, 0))
-                comparison_img.paste(restored_image, (original_image.width * 2, 0))
-                comparison_img.save(comparison_dir / f"compare_{img_path.name}")
+    @torch.no_grad()
+    def _inpaint(self, pipeline, original_images: list, mask_images: list, seeds: list) -> list:
+        """
+        Inpaints a batch in one pipeline call. Every sample gets its own generator, so its initial
+        noise, and hence its result, is the same as when it is inpainted alone with that seed.
+        Output images have the size of the inputs, which must all match. The cached null-prompt
+        embedding serves as both the prompt and the negative prompt, as `prompt=""` would.
+        """
+        generators = [torch.Generator(device=self.device).manual_seed(seed) for seed in seeds]
+        null_prompt_embeds = self._encode_null_prompt(pipeline).expand(len(original_images), -1, -1)
+        return pipeline(
+            prompt_embeds=null_prompt_embeds, negative_prompt_embeds=null_prompt_embeds,
+            image=original_images, mask_image=mask_images,
+            height=original_images[0].height, width=original_images[0].width,
+            num_inference_steps=self.config.num_inference_steps,
+            generator=generators,
+        ).images
+
+    def _shard_paths(self, output_dir: Path, shard_index: int) -> tuple:
+        """(metrics CSV, completion marker) of one shard inside a checkpoint's output directory."""
+        stem = f"shard_{shard_index:03d}_of_{self.num_shards:03d}"
+        return output_dir / SHARD_DIRNAME / f"{stem}.csv", output_dir / SHARD_DIRNAME / f"{stem}.done.json"
+
+    def _shard_samples(self, shard_index: int) -> list:
+        """`(index, (image, mask))` pairs of the samples with `index % num_shards == shard_index`."""
+        return [(idx, sample) for idx, sample in enumerate(self._find_samples()) if idx % self.num_shards == shard_index]
 
+    def _shard_fingerprint(self, checkpoint_dir: Path, samples: list) -> dict:
+        """
+        What a shard's results depend on: the checkpoint weights (mtime and size), the shard's samples
+        and the sampling settings. Stored results with a different fingerprint are discarded.
+        """
+        weights = (checkpoint_dir / UNET_WEIGHTS_NAME).stat()
+        return {
+            "checkpoint": checkpoint_dir.name,
+            "weights_mtime_ns": weights.st_mtime_ns,
+            "weights_size": weights.st_size,
+            "samples": sorted(img_path.name for _, (img_path, _) in samples),
+            "num_inference_steps": self.config.num_inference_steps,
+            "base_seed": BASE_SEED,
+        }
+
+    def _shard_is_complete(self, done_marker: Path, fingerprint: dict) -> bool:
+        return done_marker.exists() and load_json(done_marker).get("fingerprint") == fingerprint
+
+    def _read_shard_rows(self, shard_csv: Path) -> pd.DataFrame:
+        """Rows already in a shard CSV. A row cut off by a crash is dropped and the file rewritten without it."""
+        if not shard_csv.exists() or shard_csv.stat().st_size == 0:
+            return pd.DataFrame()
+        rows = pd.read_csv(shard_csv, on_bad_lines="skip")
+        complete = rows.dropna(subset=["sample_index", "filename", "psnr", "ssim"])
+        if len(complete) < len(rows):
+            complete.to_csv(shard_csv, index=False)
+        return complete
+
+    def _evaluate_checkpoint(self, pipeline, samples: list, output_dir: Path, shard_index: int, fingerprint: dict):
+        """
+        Evaluates the pipeline's current UNet on the `(index, (image, mask))` samples of one shard.
+        Metric rows are appended to the shard CSV as batches finish, so a restarted shard skips the
+        samples it already has, unless they were computed for a different `fingerprint` (other weights,
+        samples or settings), in which case the shard starts over. Comparison images go to `output_dir`.
+        A marker file with the fingerprint and the shard's throughput is written once the shard is complete.
+        """
+        shard_csv, done_marker = self._shard_paths(output_dir, shard_index)
+        fingerprint_path = done_marker.with_name(shard_csv.stem + ".fingerprint.json")
+        shard_csv.parent.mkdir(parents=True, exist_ok=True)
+        if not fingerprint_path.exists() or load_json(fingerprint_path) != fingerprint:
+            if shard_csv.exists():
+                self.logger.info(f"Discarding stale results of shard {shard_index} of {output_dir.name}: the checkpoint, samples or settings changed.")
+            shard_csv.unlink(missing_ok=True)
+            done_marker.unlink(missing_ok=True)
+            save_json(fingerprint_path, fingerprint)
+        completed = self._read_shard_rows(shard_csv)
+        if not completed.empty:
+            done_indices = set(completed["sample_index"].astype(int))
+            samples = [(idx, sample) for idx, sample in samples if idx not in done_indices]
+            self.logger.info(f"Resuming shard {shard_index} of {output_dir.name}: {len(done_indices)} samples done, {len(samples)} left.")
+
+        comparison_config = self.config.get("comparison_images", {})
+        comparison_writer = ComparisonImageWriter(
+            output_dir / "comparisons",
+            image_format=comparison_config.get("format", "png"),
+            quality=comparison_config.get("quality", 90),
+            thumbnail_size=comparison_config.get("thumbnail_size"),
+            num_workers=comparison_config.get("num_workers", 2)
+        )
+        metrics_engine = MetricsEngine(num_workers=self.metrics_workers)
+
+        def append_rows(records: list):
+            if records:
+                pd.DataFrame(records).to_csv(shard_csv, mode="a", header=not shard_csv.exists() or shard_csv.stat().st_size == 0, index=False)
+
+        num_evaluated = 0
+        batches = [samples[i:i + self.batch_size] for i in range(0, len(samples), self.batch_size)]
+        start_time = time.perf_counter()
+
+        for batch in tqdm(batches, desc=f"Evaluating shard {shard_index} (batch size {self.batch_size})"):
+            batch_samples = [{"sample_index": idx, "filename": img_path.name} for idx, (img_path, _) in batch]
+            batch_names = [sample["filename"] for sample in batch_samples]
+            try:
+                original_images = [Image.open(img_path).convert("RGB") for _, (img_path, _) in batch]
+                mask_images = [Image.open(mask_path).convert("RGB") for _, (_, mask_path) in batch]
+                restored_images = self._inpaint(pipeline, original_images, mask_images, [BASE_SEED + idx for idx, _ in batch])
             except Exception as e:
-                self.logger.error(f"Failed on sample {img_path.name}. Error: {e}")
-
-        if results:
-            df = pd.DataFrame(results)
-            df.to_csv(self.output_dir / "evaluation_metrics.csv", index=False)
-            
-            summary = f"Samples: {len(df)}\nAvg PSNR: {df['psnr'].mean():.4f}\nAvg SSIM: {df['ssim'].mean():.4f}"
-            with open(self.output_dir / "summary_report.txt", 'w') as f:
-                f.write(summary)
-            self.logger.info(f"Evaluation Complete. {summary}")
-        else:
+                self.logger.error(f"Failed on batch {batch_names}. Error: {e}")
+                continue
+
+            # Metrics and comparison images are produced on worker threads while the next batch is generated.
+            original_arrays = np.stack([np.array(img) for img in original_images])
+            restored_arrays = np.stack([np.array(img) for img in restored_images])
+            mask_arrays = np.stack([np.array(img.convert("L")) >= 128 for img in mask_images])
+            metrics_engine.submit(batch_samples, original_arrays, restored_arrays, mask_arrays)
+            for i, name in enumerate(batch_names):
+                comparison_writer.submit(name, original_arrays[i], original_arrays[i] * ~mask_arrays[i][..., None], restored_arrays[i])
+            num_evaluated += len(batch)
+            append_rows(metrics_engine.collect(wait=False))
+
+        append_rows(metrics_engine.collect())
+        metrics_engine.close()
+        failed_writes = comparison_writer.close()
+        if failed_writes:
+            self.logger.warning(f"{failed_writes} comparison images could not be written.")
+        elapsed = time.perf_counter() - start_time
+        throughput = num_evaluated / elapsed if elapsed > 0 else 0.0
+        self.logger.info(f"Shard {shard_index}: evaluated {num_evaluated} samples in {elapsed:.1f}s ({throughput:.2f} images/sec).")
+        save_json(done_marker, {"samples": len(self._read_shard_rows(shard_csv)), "images_per_sec": throughput, "fingerprint": fingerprint})
+
+    def _merge_checkpoint(self, checkpoint_dir: Path) -> dict:
+        """
+        Merges the shard CSVs of a checkpoint into `evaluation_metrics.csv` and `summary_report.txt`
+        once every shard is complete for the current fingerprint. Returns the mean metrics and throughput, or None.
+        """
+        output_dir = self._checkpoint_output_dir(checkpoint_dir)
+        shard_files = [self._shard_paths(output_dir, k) for k in range(self.num_shards)]
+        missing = [k for k, (_, done_marker) in enumerate(shard_files)
+                   if not self._shard_is_complete(done_marker, self._shard_fingerprint(checkpoint_dir, self._shard_samples(k)))]
+        if missing:
+            self.logger.info(f"{output_dir.name}: waiting for shards {missing} before merging.")
+            return None
+        df = pd.concat([self._read_shard_rows(shard_csv) for shard_csv, _ in shard_files], ignore_index=True)
+        if df.empty:
             self.logger.warning("No results generated during evaluation.")
+            return None
+        df = df.sort_values("sample_index").drop(columns="sample_index")
+        df.to_csv(output_dir / "evaluation_metrics.csv", index=False)
+
+        # Shards run concurrently, so the overall throughput is the sum of theirs.
+        throughput = sum(load_json(done_marker)["images_per_sec"] for _, done_marker in shard_files)
+        summary = (
+            f"Samples: {len(df)}\nAvg PSNR: {df['psnr'].mean():.4f}\nAvg SSIM: {df['ssim'].mean():.4f}\n"
+            f"Avg Masked PSNR: {df['masked_psnr'].mean():.4f}\nAvg Masked SSIM: {df['masked_ssim'].mean():.4f}\n"
+            f"Batch size: {self.batch_size}\nShards: {self.num_shards}\nThroughput: {throughput:.2f} images/sec"
+        )
+        with open(output_dir / "summary_report.txt", 'w') as f:
+            f.write(summary)
+        self.logger.info(f"Evaluation Complete. {summary}")
+        return {"samples": len(df), **{name: df[name].mean() for name in METRIC_NAMES}, "images_per_sec": throughput}
+
+    def _checkpoint_output_dir(self, checkpoint_dir: Path) -> Path:
+        return self.output_dir / checkpoint_dir.name if self.sweep_checkpoints else self.output_dir
+
+    def evaluate_shard(self, shard_index: int):
+        """Evaluates every checkpoint on the samples with `index % num_shards == shard_index`, loading the pipeline once."""
+        samples = self._shard_samples(shard_index)
+        # Checkpoints this shard already completed with the same fingerprint are skipped without loading anything.
+        fingerprints = {c: self._shard_fingerprint(c, samples) for c in self._find_checkpoints()}
+        checkpoints = [c for c, fingerprint in fingerprints.items()
+                       if not self._shard_is_complete(self._shard_paths(self._checkpoint_output_dir(c), shard_index)[1], fingerprint)]
+        self.logger.info(f"Shard {shard_index}/{self.num_shards}: {len(checkpoints)} checkpoint(s) to evaluate, {len(samples)} samples.")
+        if not checkpoints:
+            return
+        pipeline = self._load_pipeline(checkpoints[0])
+        for i, checkpoint_dir in enumerate(checkpoints):
+            if i > 0:
+                self._swap_unet(pipeline, checkpoint_dir)
+            self._evaluate_checkpoint(pipeline, samples, self._checkpoint_output_dir(checkpoint_dir), shard_index, fingerprints[checkpoint_dir])
+
+    def evaluate(self):
+        """
+        Runs the full evaluation process. With `num_shards` > 1, the test set is split by sample
+        index; `shard_index` runs one shard (e.g. one per machine sharing `output_dir`), otherwise
+        every shard runs here in its own process. Results are merged once all shards are complete.
+        """
+        if not self._find_samples():
+            self.logger.warning("Test data not found. Skipping evaluation.")
+            return
+        checkpoints = self._find_checkpoints()
+        if not checkpoints:
+            self.logger.warning(f"No UNet checkpoints found in {self.config.trained_model_dir}. Skipping evaluation.")
+            return
+
+        if self.shard_index is not None:
+            self.evaluate_shard(self.shard_index)
+        elif self.num_shards == 1:
+            self.evaluate_shard(0)
+        else:
+            self.logger.info(f"Running {self.num_shards} evaluation shards in parallel processes.")
+            # spawn: every worker initializes torch (and CUDA) from scratch
+            with ProcessPoolExecutor(max_workers=self.num_shards, mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [executor.submit(_evaluate_shard, self.config, self.test_data_dir, k) for k in range(self.num_shards)]
+                for future in futures:
+                    future.result()
+
+        sweep_rows = []
+        for checkpoint_dir in checkpoints:
+            summary = self._merge_checkpoint(checkpoint_dir)
+            if summary is not None:
+                sweep_rows.append({"checkpoint": checkpoint_dir.name, **summary})
+
+        if self.sweep_checkpoints and len(sweep_rows) == len(checkpoints):
+            sweep_df = pd.DataFrame(sweep_rows)
+            sweep_df.to_csv(self.output_dir / SWEEP_METRICS_FILENAME, index=False)
+            best = sweep_df.loc[sweep_df["masked_psnr"].idxmax()]
+            self.logger.info(f"Checkpoint sweep metrics:\n{sweep_df.to_string(index=False)}")
+            self.logger.info(f"Best checkpoint by masked PSNR: {best['checkpoint']} ({best['masked_psnr']:.4f} dB)")
+
+
+def _evaluate_shard(config, test_data_dir: Path, shard_index: int):
+    """Entry point of a shard worker process."""
+    ModelEvaluator(config, test_data_dir).evaluate_shard(shard_index)
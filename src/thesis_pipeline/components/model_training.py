@@ -1,5 +1,6 @@
 # src/thesis_pipeline/components/model_training.py
 import logging
+from pathlib import Path
 import torch
 import torch.nn.functional as F
 from diffusers import AutoencoderKL, DDPMScheduler, UNet2DConditionModel
@@ -9,36 +10,119 @@ from diffusers.optimization import get_scheduler
 from accelerate import Accelerator
 from tqdm.auto import tqdm
 from box import ConfigBox
+from thesis_pipeline.components.latent_cache import LatentCache, CachedLatentDataset, sample_from_cache
+from thesis_pipeline.components.masking import generate_random_rectangle_masks
+
+NULL_PROMPT_CACHE_SUFFIX = "_null_prompt.pt"
+
+
+def null_prompt_cache_path(cache_dir: Path, model_id: str) -> Path:
+    """Cache file of a model's empty-prompt embedding; '/' in Hub ids becomes '--', as in the Hugging Face cache."""
+    return Path(cache_dir) / f"{model_id.replace('/', '--')}{NULL_PROMPT_CACHE_SUFFIX}"
 
 class ModelTrainer:
-    def __init__(self, config: ConfigBox, hyperparams: ConfigBox):
+    def __init__(self, config: ConfigBox, hyperparams: ConfigBox, online_mask_config: dict = None):
+        """
+        Args:
+            online_mask_config (dict): If given ('min_mask_size_ratio', 'max_mask_size_ratio', 'seed'),
+                a fresh batch of rectangle masks is generated on the device for every training step,
+                seeded per epoch, instead of using the stored masks.
+        """
         self.config = config
         self.hyperparams = hyperparams
+        self.online_mask_config = online_mask_config
         self.logger = logging.getLogger(__name__)
         
         self.accelerator = Accelerator(
             mixed_precision=self.hyperparams.get('mixed_precision', 'no')
         )
         self.device = self.accelerator.device
+        self.unet = None
         self.logger.info(f"Using device: {self.device} with mixed precision: {self.accelerator.mixed_precision}")
 
     def _load_pretrained_models(self):
-        """Loads all necessary model components from Hugging Face."""
+        """
+        Loads the model components trained or used on every step from Hugging Face. The text
+        encoder is not among them: only the empty-prompt embedding is needed (see `_null_prompt_embeds`).
+        """
+        if self.unet is not None:
+            return
         try:
             model_id = self.hyperparams.model_id
-            self.tokenizer = CLIPTokenizer.from_pretrained(model_id, subfolder="tokenizer")
-            self.text_encoder = CLIPTextModel.from_pretrained(model_id, subfolder="text_encoder")
             self.vae = AutoencoderKL.from_pretrained(model_id, subfolder="vae")
             self.unet = UNet2DConditionModel.from_pretrained(model_id, subfolder="unet")
             self.noise_scheduler = DDPMScheduler.from_pretrained(model_id, subfolder="scheduler")
             
             self.vae.requires_grad_(False)
-            self.text_encoder.requires_grad_(False)
+            # The frozen VAE is not passed through accelerator.prepare, so move it explicitly.
+            self.vae.to(self.device)
             self.logger.info(f"Successfully loaded pretrained models from '{model_id}'")
         except Exception as e:
             self.logger.error(f"Failed to load models. Check model_id and internet. Error: {e}")
             raise
 
+    @torch.no_grad()
+    def _null_prompt_embeds(self) -> torch.Tensor:
+        """
+        Text embedding (1, seq_len, dim) of the empty prompt, the only conditioning used in training.
+        It is read from `text_embedding_cache_dir` when cached for this model_id; otherwise the
+        tokenizer and text encoder are loaded on the CPU just to encode it, cached, and released.
+        """
+        model_id = self.hyperparams.model_id
+        cache_dir = self.config.get("text_embedding_cache_dir")
+        cache_path = null_prompt_cache_path(cache_dir, model_id) if cache_dir else None
+        if cache_path is not None and cache_path.exists():
+            self.logger.info(f"Loaded the null-prompt embedding of '{model_id}' from {cache_path}")
+            return torch.load(cache_path, map_location="cpu")
+
+        tokenizer = CLIPTokenizer.from_pretrained(model_id, subfolder="tokenizer")
+        text_encoder = CLIPTextModel.from_pretrained(model_id, subfolder="text_encoder")
+        text_input = tokenizer("", padding="max_length", max_length=tokenizer.model_max_length, truncation=True, return_tensors="pt")
+        embeds = text_encoder(text_input.input_ids)[0]
+        del text_encoder
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            torch.save(embeds, cache_path)
+            self.logger.info(f"Cached the null-prompt embedding of '{model_id}' to {cache_path}")
+        return embeds
+
+    def build_latent_cache(self, dataset, cache_dir: Path, shard_size: int, batch_size: int) -> CachedLatentDataset:
+        """
+        Encodes `dataset` once with the frozen VAE and returns a dataset of cached latent-distribution
+        parameters, so the training loop no longer runs the VAE on every step.
+        """
+        self._load_pretrained_models()
+        self.vae.eval()
+        latent_cache = LatentCache(cache_dir, shard_size)
+        return latent_cache.build(self.vae, dataset, batch_size, self.device)
+
+    def _apply_online_masks(self, batch: dict, mask_generator: torch.Generator) -> dict:
+        """Replaces the stored masks of a batch with freshly generated ones."""
+        original_images = batch["original_image"]
+        batch_size, _, height, width = original_images.shape
+        masks = generate_random_rectangle_masks(
+            batch_size, height, width,
+            self.online_mask_config["min_mask_size_ratio"],
+            self.online_mask_config["max_mask_size_ratio"],
+            generator=mask_generator,
+            device=original_images.device
+        ).to(original_images.dtype)
+        return {**batch, "mask": masks, "masked_image": original_images * (1 - masks)}
+
+    def _get_latents(self, batch) -> tuple:
+        """Returns scaled (latents, masked latents, latent-resolution mask) for a batch, from the cache if available."""
+        scaling_factor = self.vae.config.scaling_factor
+        if "latent_mean" in batch:
+            latents = sample_from_cache(batch["latent_mean"], batch["latent_logvar"]) * scaling_factor
+            masked_latents = sample_from_cache(batch["masked_latent_mean"], batch["masked_latent_logvar"]) * scaling_factor
+            return latents, masked_latents, batch["latent_mask"]
+
+        with torch.no_grad():
+            latents = self.vae.encode(batch["original_image"]).latent_dist.sample() * scaling_factor
+            masked_latents = self.vae.encode(batch["masked_image"]).latent_dist.sample() * scaling_factor
+        mask = F.interpolate(batch["mask"], size=latents.shape[-2:])
+        return latents, masked_latents, mask
+
     def train(self, train_dataloader, val_dataloader):
         """The main training loop."""
         self._load_pretrained_models()
@@ -62,30 +146,29 @@ class ModelTrainer:
             self.unet, optimizer, train_dataloader, val_dataloader, lr_scheduler
         )
 
-        text_input = self.tokenizer("", padding="max_length", max_length=self.tokenizer.model_max_length, truncation=True, return_tensors="pt")
-        with torch.no_grad():
-            text_embeddings = self.text_encoder(text_input.input_ids.to(self.device))[0]
-        null_prompt_embeds = text_embeddings.repeat(self.config.train_batch_size, 1, 1)
+        null_prompt_embeds = self._null_prompt_embeds().to(self.device)
 
         self.logger.info("Starting training loop...")
         for epoch in range(self.config.num_epochs):
             self.unet.train()
+            if self.online_mask_config is not None:
+                # Reseeded every epoch: masks differ between epochs but a rerun reproduces them exactly.
+                mask_generator = torch.Generator(device=self.device).manual_seed(self.online_mask_config["seed"] + epoch)
             progress_bar = tqdm(total=len(train_dataloader), desc=f"Epoch {epoch + 1}/{self.config.num_epochs}")
             
             for step, batch in enumerate(train_dataloader):
                 with self.accelerator.accumulate(self.unet):
-                    with torch.no_grad():
-                        latents = self.vae.encode(batch["original_image"]).latent_dist.sample() * self.vae.config.scaling_factor
-                        masked_latents = self.vae.encode(batch["masked_image"]).latent_dist.sample() * self.vae.config.scaling_factor
-                    
-                    mask = F.interpolate(batch["mask"], size=latents.shape[-2:])
+                    if self.online_mask_config is not None:
+                        batch = self._apply_online_masks(batch, mask_generator)
+                    latents, masked_latents, mask = self._get_latents(batch)
                     noise = torch.randn_like(latents)
                     bsz = latents.shape[0]
                     timesteps = torch.randint(0, self.noise_scheduler.config.num_train_timesteps, (bsz,), device=latents.device).long()
                     noisy_latents = self.noise_scheduler.add_noise(latents, noise, timesteps)
                     
                     latent_model_input = torch.cat([noisy_latents, mask, masked_latents], dim=1)
-                    noise_pred = self.unet(latent_model_input, timesteps, null_prompt_embeds).sample
+                    # Broadcast to the actual batch size, which is smaller for a final partial batch.
+                    noise_pred = self.unet(latent_model_input, timesteps, null_prompt_embeds.expand(bsz, -1, -1)).sample
                     loss = F.mse_loss(noise_pred, noise, reduction="mean")
                     
                     self.accelerator.backward(loss)
@@ -0,0 +1,157 @@
+# src/thesis_pipeline/components/packed_dataset.py
+import io
+import os
+import json
+import random
+import logging
+import tarfile
+from pathlib import Path
+
+INDEX_FILENAME = "index.json"
+
+
+class PackedShardWriter:
+    """
+    Writes (image, mask) sample pairs into tar shards of `shard_size` samples each, plus an
+    index recording the byte offset and length of every member. Shards are plain tar files,
+    so they stay inspectable with standard tools.
+    """
+    def __init__(self, output_dir: Path, shard_size: int):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.logger = logging.getLogger(__name__)
+        self.samples = []
+        self._shard_names = []
+        self._tar = None
+        self._samples_in_shard = 0
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+    def _open_next_shard(self):
+        self._close_shard()
+        shard_name = f"shard_{len(self._shard_names):05d}.tar"
+        self._shard_names.append(shard_name)
+        self._tar = tarfile.open(self.output_dir / shard_name, "w")
+        self._samples_in_shard = 0
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._tar = None
+
+    def _add_member(self, name: str, data: bytes):
+        tar_info = tarfile.TarInfo(name)
+        tar_info.size = len(data)
+        self._tar.addfile(tar_info, io.BytesIO(data))
+
+    def add(self, key: str, image_bytes: bytes, mask_bytes: bytes):
+        """Appends one sample; `image_bytes` and `mask_bytes` are encoded image files (e.g. PNG)."""
+        if self._tar is None or self._samples_in_shard >= self.shard_size:
+            self._open_next_shard()
+        self._add_member(f"{key}.image", image_bytes)
+        self._add_member(f"{key}.mask", mask_bytes)
+        self.samples.append({"key": key, "shard": self._shard_names[-1]})
+        self._samples_in_shard += 1
+
+    def close(self):
+        """Closes the last shard and writes the index with member offsets read back from each shard."""
+        self._close_shard()
+        offsets = {}
+        for shard_name in self._shard_names:
+            with tarfile.open(self.output_dir / shard_name, "r") as tar:
+                for member in tar.getmembers():
+                    offsets[(shard_name, member.name)] = [member.offset_data, member.size]
+
+        for sample in self.samples:
+            sample["image"] = offsets[(sample["shard"], f"{sample['key']}.image")]
+            sample["mask"] = offsets[(sample["shard"], f"{sample['key']}.mask")]
+
+        index_path = self.output_dir / INDEX_FILENAME
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump({"shards": self._shard_names, "samples": self.samples}, f, ensure_ascii=False)
+        self.logger.info(f"Packed {len(self.samples)} samples into {len(self._shard_names)} shards at {self.output_dir}")
+
+
+class PackedShardReader:
+    """
+    Random-access reader for shards written by PackedShardWriter.
+    Each sample costs two positioned reads on an already-open shard file instead of two
+    open/read/close cycles on loose files. File handles are opened lazily per process, so
+    the reader can be shared with DataLoader worker processes.
+    """
+    def __init__(self, packed_dir: Path):
+        self.packed_dir = packed_dir
+        index_path = packed_dir / INDEX_FILENAME
+        if not index_path.exists():
+            raise FileNotFoundError(f"Packed dataset index not found at: {index_path}")
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        self.samples = index["samples"]
+        self.keys = [sample["key"] for sample in self.samples]
+        self._handles = {}
+        self._owner_pid = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _get_handle(self, shard_name: str):
+        if self._owner_pid != os.getpid():
+            # Never reuse handles inherited from a parent process; their file offsets are shared.
+            self._handles = {}
+            self._owner_pid = os.getpid()
+        handle = self._handles.get(shard_name)
+        if handle is None:
+            handle = open(self.packed_dir / shard_name, "rb")
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            self._handles[shard_name] = handle
+        return handle
+
+    def read(self, idx: int) -> tuple:
+        """Returns the encoded (image bytes, mask bytes) of sample `idx`."""
+        sample = self.samples[idx]
+        handle = self._get_handle(sample["shard"])
+        image_offset, image_size = sample["image"]
+        mask_offset, mask_size = sample["mask"]
+        handle.seek(image_offset)
+        image_bytes = handle.read(image_size)
+        handle.seek(mask_offset)
+        mask_bytes = handle.read(mask_size)
+        return image_bytes, mask_bytes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_handles"] = {}
+        state["_owner_pid"] = None
+        return state
+
+
+class ShardAwareSampler:
+    """
+    Shuffles shard order and sample order within each shard, so consecutive reads stay inside
+    one shard file (sequential, read-ahead friendly) while every epoch still sees a new order.
+    """
+    def __init__(self, reader: PackedShardReader, seed: int = 0):
+        self.seed = seed
+        self.epoch = 0
+        self._indices_by_shard = {}
+        for idx, sample in enumerate(reader.samples):
+            self._indices_by_shard.setdefault(sample["shard"], []).append(idx)
+        self._length = len(reader)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        shard_names = sorted(self._indices_by_shard)
+        rng.shuffle(shard_names)
+        for shard_name in shard_names:
+            indices = list(self._indices_by_shard[shard_name])
+            rng.shuffle(indices)
+            yield from indices
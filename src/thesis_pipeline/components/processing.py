@@ -1,18 +1,84 @@
 # src/thesis_pipeline/components/processing.py
+import os
 import logging
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
 from PIL import Image
 from tqdm import tqdm
+from thesis_pipeline.components.content_index import compute_sha1
+from thesis_pipeline.utils.common import PersistentRecordStore
+from thesis_pipeline.components.metadata_store import ImageMetadataStore, normalize_path
+
+# Modes that `Image.reduce` averages correctly; palette, bilevel and 16-bit images are converted first.
+REDUCIBLE_MODES = {"L", "LA", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F"}
+
+def _reduce_for_target(img: Image.Image, target_size: tuple, oversample: float) -> Image.Image:
+    """
+    Shrinks a large image cheaply before the final high-quality resize, keeping it at least
+    `oversample` times the target size. JPEGs are decoded directly at 1/2, 1/4 or 1/8 scale
+    via `draft`, which also cuts peak memory; other formats are box-reduced by an integer factor,
+    after conversion to RGB if their mode cannot be reduced.
+    """
+    min_width, min_height = int(target_size[0] * oversample), int(target_size[1] * oversample)
+    if img.format == "JPEG":
+        img.draft(img.mode, (min_width, min_height))
+        return img
+    factor = min(img.width // min_width, img.height // min_height)
+    if factor < 2:
+        return img
+    if img.mode not in REDUCIBLE_MODES:
+        img = img.convert("RGB")
+    return img.reduce(factor)
+
+
+def _process_single_image(img_path: Path, output_dir: Path, target_size: tuple, output_format: str,
+                          fast_decode: bool = False, fast_decode_oversample: float = 2.0) -> tuple:
+    """
+    Converts one image to RGB, resizes it and saves it.
+    Lives at module level so it can be shipped to worker processes; the serial and parallel
+    paths both run exactly this function, so their outputs are identical.
+    Returns (worker pid, error message or None, SHA-1 of the source file).
+    """
+    try:
+        source_sha1 = compute_sha1(img_path)
+        with Image.open(img_path) as img:
+            if fast_decode:
+                img = _reduce_for_target(img, target_size, fast_decode_oversample)
+            img_rgb = img.convert('RGB')
+            img_resized = img_rgb.resize(target_size, Image.Resampling.LANCZOS)
+
+            output_filename = f"{img_path.stem}.{output_format.lower()}"
+            output_path = output_dir / output_filename
+
+            img_resized.save(output_path, format=output_format)
+        return os.getpid(), None, source_sha1
+    except Exception as e:
+        return os.getpid(), str(e), None
+
 
 class ImageProcessor:
     """
     Encapsulates the logic for processing raw images.
+    A processing manifest in the output directory records the source file and parameters behind
+    every output, so re-runs only process new or changed images and remove stale outputs.
+    With a metadata store, the size and mode of every output are recorded there, so later
+    stages can look them up instead of opening the processed images.
     """
-    def __init__(self, input_dir: Path, output_dir: Path, image_size: tuple, output_format: str):
+    def __init__(self, input_dir: Path, output_dir: Path, image_size: tuple, output_format: str,
+                 num_workers: int = 1, chunk_size: int = 16, fast_decode: bool = False,
+                 fast_decode_oversample: float = 2.0, metadata_store: ImageMetadataStore = None):
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.target_size = image_size
         self.output_format = output_format
+        # 0 means "use every core"
+        self.num_workers = num_workers if num_workers > 0 else os.cpu_count()
+        self.chunk_size = chunk_size
+        self.fast_decode = fast_decode
+        self.fast_decode_oversample = fast_decode_oversample
+        self.metadata_store = metadata_store
+        self.manifest_path = output_dir / "processing_manifest.json"
         self.logger = logging.getLogger(__name__)
 
     def _find_image_files(self) -> list:
@@ -24,43 +90,137 @@ class ImageProcessor:
         self.logger.info(f"Found {len(image_files)} image files in {self.input_dir}.")
         return image_files
 
+    def _output_name(self, img_path: Path) -> str:
+        return f"{img_path.stem}.{self.output_format.lower()}"
+
+    def _processing_params(self) -> dict:
+        params = {"image_size": list(self.target_size), "format": self.output_format, "fast_decode": self.fast_decode}
+        if self.fast_decode:
+            params["fast_decode_oversample"] = self.fast_decode_oversample
+        return params
+
+    def _is_up_to_date(self, img_path: Path, entry: dict) -> bool:
+        """
+        True if the existing output was produced from the current source content with the current parameters.
+        Size and mtime are checked first; only when they differ is the source re-hashed.
+        """
+        if entry is None or entry["source"] != img_path.name or entry["params"] != self._processing_params():
+            return False
+        if not (self.output_dir / self._output_name(img_path)).exists():
+            return False
+        source_stat = img_path.stat()
+        if entry["source_size"] == source_stat.st_size and entry["source_mtime_ns"] == source_stat.st_mtime_ns:
+            return True
+        if entry["source_size"] == source_stat.st_size and entry["source_sha1"] == compute_sha1(img_path):
+            entry["source_mtime_ns"] = source_stat.st_mtime_ns  # Touched but unchanged
+            return True
+        return False
+
+    def _remove_stale_outputs(self, manifest: PersistentRecordStore, image_files: list) -> int:
+        """Deletes outputs whose source image no longer exists in the input directory."""
+        current_outputs = {self._output_name(p): p.name for p in image_files}
+        stale_outputs = [name for name, entry in manifest.entries.items() if current_outputs.get(name) != entry["source"]]
+        for output_name in stale_outputs:
+            (self.output_dir / output_name).unlink(missing_ok=True)
+            del manifest.entries[output_name]
+        if stale_outputs:
+            self.logger.info(f"Removed {len(stale_outputs)} stale outputs whose source images are gone.")
+        return len(stale_outputs)
+
+    def _iter_results(self, image_files: list):
+        """Yields (image path, worker pid, error, source SHA-1) for every image, serially or on a process pool."""
+        args = (self.output_dir, self.target_size, self.output_format, self.fast_decode, self.fast_decode_oversample)
+        if self.num_workers == 1:
+            for img_path in image_files:
+                yield (img_path, *_process_single_image(img_path, *args))
+            return
+
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            results = executor.map(
+                _process_single_image,
+                image_files,
+                *[[arg] * len(image_files) for arg in args],
+                chunksize=self.chunk_size
+            )
+            for img_path, (worker_pid, error, source_sha1) in zip(image_files, results):
+                yield img_path, worker_pid, error, source_sha1
+
+    def _record_output_metadata(self, manifest: PersistentRecordStore):
+        """Writes the metadata of every current output (all RGB at the target size) to the metadata store."""
+        records = []
+        for output_name in manifest.entries:
+            output_path = self.output_dir / output_name
+            try:
+                output_stat = output_path.stat()
+            except OSError:
+                continue
+            records.append({
+                "path": normalize_path(output_path), "filename": output_name, "mtime_ns": output_stat.st_mtime_ns,
+                "size_bytes": output_stat.st_size, "width": self.target_size[0], "height": self.target_size[1], "mode": "RGB"
+            })
+        self.metadata_store.upsert(pd.DataFrame(records))
+        self.metadata_store.prune(self.output_dir, [record["path"] for record in records])
+
     def process_images(self) -> dict:
         """
         Processes raw images by resizing, converting to RGB, and saving them.
         Returns a summary of the operation.
         """
         image_files = self._find_image_files()
-        
+        manifest = PersistentRecordStore(self.manifest_path, flush_every=500)
+        removed_count = self._remove_stale_outputs(manifest, image_files)
+
         if not image_files:
+            manifest.flush()
             self.logger.warning("No images found in the input directory. Nothing to process.")
-            return {"processed_count": 0, "error_count": 0, "total_found": 0}
+            return {"processed_count": 0, "error_count": 0, "total_found": 0, "removed_count": removed_count}
+
+        pending_files = [p for p in image_files if not self._is_up_to_date(p, manifest.get(self._output_name(p)))]
+        skipped_count = len(image_files) - len(pending_files)
+        if skipped_count:
+            self.logger.info(f"Skipping {skipped_count} images that are unchanged since the last run.")
+
+        self.logger.info(
+            f"Processing {len(pending_files)} images. Target size: {self.target_size}, Format: {self.output_format}, "
+            f"Workers: {self.num_workers}, Fast decode: {self.fast_decode}"
+        )
 
-        self.logger.info(f"Processing {len(image_files)} images. Target size: {self.target_size}, Format: {self.output_format}")
-        
         processed_count = 0
         error_count = 0
+        worker_error_counts = {}
 
-        for img_path in tqdm(image_files, desc="Processing Images"):
-            try:
-                with Image.open(img_path) as img:
-                    img_rgb = img.convert('RGB')
-                    img_resized = img_rgb.resize(self.target_size, Image.Resampling.LANCZOS)
-                    
-                    output_filename = f"{img_path.stem}.{self.output_format.lower()}"
-                    output_path = self.output_dir / output_filename
-                    
-                    img_resized.save(output_path, format=self.output_format)
-                    processed_count += 1
-
-            except Exception as e:
-                self.logger.error(f"Failed to process {img_path}. Error: {e}")
+        results = self._iter_results(pending_files) if pending_files else []
+        for img_path, worker_pid, error, source_sha1 in tqdm(results, total=len(pending_files), desc="Processing Images"):
+            worker_key = f"worker_{worker_pid}"
+            worker_error_counts.setdefault(worker_key, 0)
+            if error is None:
+                processed_count += 1
+                source_stat = img_path.stat()
+                manifest.set(self._output_name(img_path), {
+                    "source": img_path.name,
+                    "source_size": source_stat.st_size,
+                    "source_mtime_ns": source_stat.st_mtime_ns,
+                    "source_sha1": source_sha1,
+                    "params": self._processing_params()
+                })
+            else:
+                self.logger.error(f"Failed to process {img_path}. Error: {error}")
                 error_count += 1
-        
+                worker_error_counts[worker_key] += 1
+
+        manifest.flush()
+        self.logger.info(f"Processing manifest saved to: {self.manifest_path}")
+        if self.metadata_store is not None:
+            self._record_output_metadata(manifest)
+
         summary = {
             "processed_count": processed_count,
+            "skipped_count": skipped_count,
+            "removed_count": removed_count,
             "error_count": error_count,
-            "total_found": len(image_files)
+            "total_found": len(image_files),
+            "num_workers": self.num_workers,
+            "worker_error_counts": worker_error_counts
         }
         self.logger.info(f"Image processing complete. Summary: {summary}")
         return summary
-
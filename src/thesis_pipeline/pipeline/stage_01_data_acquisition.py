@@ -23,7 +23,14 @@ class DataAcquisitionStage:
             
             self.logger.info(f"Output directory set to: {output_dir}")
 
-            acquirer = DataAcquisition(api_url=self.config.wikimedia_api_url)
+            acquirer = DataAcquisition(
+                api_url=self.config.wikimedia_api_url,
+                max_workers=self.config.max_workers,
+                requests_per_second=self.config.requests_per_second,
+                max_retries=self.config.max_retries,
+                backoff_factor=self.config.backoff_factor,
+                timeout=self.config.request_timeout
+            )
             
             acquirer.download_images_from_category(
                 start_category=self.config.start_category,
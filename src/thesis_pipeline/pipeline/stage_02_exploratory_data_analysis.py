@@ -3,6 +3,7 @@ import logging
 from pathlib import Path
 from thesis_pipeline.config_manager import ConfigManager
 from thesis_pipeline.components.exploratory_data_analysis import ExploratoryDataAnalyzer
+from thesis_pipeline.components.metadata_store import ImageMetadataStore
 
 class ExploratoryDataAnalysisStage:
     def __init__(self, config_manager: ConfigManager):
@@ -27,7 +28,12 @@ class ExploratoryDataAnalysisStage:
             analyzer = ExploratoryDataAnalyzer(
                 input_dir=input_dir,
                 output_dir=output_dir,
-                extensions=self.config.image_extensions
+                extensions=self.config.image_extensions,
+                num_workers=self.config.num_workers,
+                metadata_store=ImageMetadataStore(Path(self.paths.metadata_store)),
+                quality_config=self.config.get("quality_stats"),
+                plot_workers=self.config.plot_workers,
+                max_scatter_points=self.config.max_scatter_points
             )
             
             analyzer.run()
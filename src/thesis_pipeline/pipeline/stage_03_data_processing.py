@@ -3,6 +3,7 @@ import logging
 from pathlib import Path
 from thesis_pipeline.config_manager import ConfigManager
 from thesis_pipeline.components.processing import ImageProcessor
+from thesis_pipeline.components.metadata_store import ImageMetadataStore
 from thesis_pipeline.utils.common import save_json
 
 class DataProcessingStage:
@@ -32,7 +33,12 @@ class DataProcessingStage:
                 input_dir=input_dir,
                 output_dir=output_dir,
                 image_size=tuple(self.config.image_size),
-                output_format=self.config.format
+                output_format=self.config.format,
+                num_workers=self.config.num_workers,
+                chunk_size=self.config.chunk_size,
+                fast_decode=self.config.fast_decode,
+                fast_decode_oversample=self.config.fast_decode_oversample,
+                metadata_store=ImageMetadataStore(Path(self.paths.metadata_store))
             )
             
             self.logger.info("ImageProcessor initialized. Starting processing...")
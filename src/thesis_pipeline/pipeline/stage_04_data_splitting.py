@@ -3,6 +3,8 @@ import logging
 from pathlib import Path
 from thesis_pipeline.config_manager import ConfigManager
 from thesis_pipeline.components.splitting import DataSplitter
+from thesis_pipeline.components.metadata_store import ImageMetadataStore
+from thesis_pipeline.components.content_index import ContentIndex, INDEXED_EXTENSIONS
 
 class DataSplittingStage:
     def __init__(self, config_manager: ConfigManager):
@@ -33,9 +35,20 @@ class DataSplittingStage:
                 output_dir=output_dir,
                 test_size=self.config.test_size,
                 validation_size=self.config.validation_size,
-                random_state=self.global_params.random_state
+                random_state=self.global_params.random_state,
+                split_mode=self.config.split_mode,
+                split_strategy=self.config.split_strategy,
+                metadata_store=ImageMetadataStore(Path(self.paths.metadata_store)),
+                metadata_root=Path(self.paths.raw_images),
+                stratify_by=self.config.stratify_by,
+                num_bins=self.config.num_bins
             )
             
+            raw_dir = Path(self.paths.raw_images)
+            content_index = ContentIndex(raw_dir / "content_index.json")
+            content_index.update_from_directory(raw_dir, INDEXED_EXTENSIONS)
+            splitter.flag_near_duplicates(content_index, self.config.near_duplicate_max_distance)
+
             self.logger.info("DataSplitter initialized. Starting splitting...")
             splitter.split_data()
             
@@ -2,13 +2,19 @@
 import logging
 from pathlib import Path
 from thesis_pipeline.config_manager import ConfigManager
-from thesis_pipeline.components.masking import MaskingStrategy
+from thesis_pipeline.components.masking import MaskingStrategy, INPAINTING_MANIFEST_FILENAME
+from thesis_pipeline.components.splitting import SPLIT_NAMES, SPLIT_MANIFEST_FILENAME, read_split_manifest
+from thesis_pipeline.components.metadata_store import ImageMetadataStore
+from thesis_pipeline.utils.common import save_csv
 
 class FeatureEngineeringStage:
     def __init__(self, config_manager: ConfigManager):
         self.config_manager = config_manager
         self.config = config_manager.get_feature_engineering_config()
         self.paths = config_manager.get_data_paths()
+        # Stage 03 names its outputs '<stem>.<format>', e.g. '.png' or '.jpeg'.
+        self.image_suffix = f".{config_manager.get_data_processing_config().format.lower()}"
+        self.global_params = config_manager.get_global_params()
         self.logger = logging.getLogger(__name__)
 
     def run(self):
@@ -28,31 +34,67 @@ class FeatureEngineeringStage:
             output_dir.mkdir(parents=True, exist_ok=True)
             self.logger.info(f"Ensured output directory exists: {output_dir}")
 
-            # Initialize the masking strategy
-            masking_strategy = MaskingStrategy(
-                strategy_name=self.config.mask_strategy,
-                mask_config=self.config.mask_config.to_dict() # Convert ConfigBox to dict
-            )
-            
-            self.logger.info(f"Masking strategy '{self.config.mask_strategy}' initialized.")
-            
+            self.logger.info(f"Masking strategy: '{self.config.mask_strategy}'")
+
+            # Stage 04 always writes the split index; split directories only exist when they were materialized.
+            split_manifest_path = input_dir / SPLIT_MANIFEST_FILENAME
+            files_by_split = None
+            if split_manifest_path.exists():
+                files_by_split = read_split_manifest(split_manifest_path)
+                self.logger.info(f"Reading splits from the split manifest: {split_manifest_path}")
+
+            metadata_store = ImageMetadataStore(Path(self.paths.metadata_store))
+            dataset_rows = []
             # Process each split (train, validation, test)
-            for split in ["train", "validation", "test"]:
+            for split_index, split in enumerate(SPLIT_NAMES):
                 self.logger.info(f"--- Processing '{split}' split ---")
+                # Seeded per split, so one split's masks do not depend on the size of another.
+                masking_strategy = MaskingStrategy(
+                    strategy_name=self.config.mask_strategy,
+                    mask_config=self.config.mask_config.to_dict(), # Convert ConfigBox to dict
+                    seed=[self.global_params.random_state, split_index],
+                    num_workers=self.config.num_workers,
+                    metadata_store=metadata_store
+                )
                 split_input_dir = input_dir / split
                 split_output_dir = output_dir / split
                 split_output_dir.mkdir(parents=True, exist_ok=True)
-                
-                if not split_input_dir.exists():
+                if files_by_split is not None:
+                    image_files = [p for p in files_by_split[split] if p.suffix.lower() == self.image_suffix]
+                    dropped = len(files_by_split[split]) - len(image_files)
+                    if dropped:
+                        self.logger.warning(
+                            f"Skipping {dropped} files of the '{split}' split that are not '{self.image_suffix}' "
+                            f"images (data_processing.format)."
+                        )
+                elif not split_input_dir.exists():
                     self.logger.warning(f"Input directory for split '{split}' does not exist: {split_input_dir}")
                     continue
+                else:
+                    image_files = sorted(p for p in split_input_dir.iterdir() if p.is_file() and p.suffix.lower() == self.image_suffix)
 
-                masking_strategy.create_inpainting_dataset(
-                    image_dir=split_input_dir,
-                    output_dir=split_output_dir
-                )
+                if self.config.output_format == "packed" and split in self.config.packed_splits:
+                    masking_strategy.create_packed_inpainting_dataset(
+                        image_dir=split_input_dir,
+                        output_dir=split_output_dir,
+                        shard_size=self.config.shard_size,
+                        image_files=image_files
+                    )
+                else:
+                    written = masking_strategy.create_inpainting_dataset(
+                        image_dir=split_input_dir,
+                        output_dir=split_output_dir,
+                        image_files=image_files
+                    )
+                    dataset_rows.extend(
+                        {"filename": name, "split": split, "image": f"{split}/ground_truth/{name}", "mask": f"{split}/masks/{name}"}
+                        for name in written
+                    )
                 self.logger.info(f"Finished processing '{split}' split.")
 
+            # Index of the loose-file splits, read by InpaintingDataset instead of listing directories.
+            save_csv(output_dir / INPAINTING_MANIFEST_FILENAME, dataset_rows)
+
             self.logger.info("Successfully created inpainting datasets for all splits.")
             self.logger.info("="*20 + " STAGE 03 COMPLETED " + "="*20 + "\n")
 
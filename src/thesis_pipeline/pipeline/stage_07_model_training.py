@@ -5,6 +5,7 @@ import torch
 from torch.utils.data import DataLoader
 from thesis_pipeline.config_manager import ConfigManager
 from thesis_pipeline.components.dataset import InpaintingDataset
+from thesis_pipeline.components.packed_dataset import ShardAwareSampler
 from thesis_pipeline.components.model_training import ModelTrainer
 from thesis_pipeline.utils.common import load_yaml
 
@@ -14,6 +15,8 @@ class ModelTrainingStage:
         self.config = config_manager.get_training_config()
         self.paths = config_manager.get_data_paths()
         self.dp_config = config_manager.get_data_processing_config()
+        self.fe_config = config_manager.get_feature_engineering_config()
+        self.global_params = config_manager.get_global_params()
         self.logger = logging.getLogger(__name__)
 
     def run(self):
@@ -30,13 +33,57 @@ class ModelTrainingStage:
             dataset_root = Path(self.paths.inpainting_dataset)
             image_size = self.dp_config.image_size
             
-            train_dataset = InpaintingDataset(dataset_root, image_size, "train")
-            val_dataset = InpaintingDataset(dataset_root, image_size, "validation")
+            packed_splits = self.fe_config.packed_splits if self.fe_config.output_format == "packed" else []
+
+            decoded_cache_dir = self.config.decoded_cache_dir
+            if decoded_cache_dir:
+                self.logger.info(f"Decoded memmap cache enabled at: {decoded_cache_dir}")
+
+            online_masks = self.config.online_masks
+            if online_masks:
+                self.logger.info("Online masks enabled: training masks are generated per batch; stored train masks are not read.")
+
+            train_dataset = InpaintingDataset(
+                dataset_root, image_size, "train", packed="train" in packed_splits, cache_dir=decoded_cache_dir,
+                load_masks=not online_masks
+            )
+            val_dataset = InpaintingDataset(
+                dataset_root, image_size, "validation", packed="validation" in packed_splits, cache_dir=decoded_cache_dir
+            )
+
+            # --- Initialize Trainer ---
+            online_mask_config = None
+            if online_masks:
+                online_mask_config = {
+                    "min_mask_size_ratio": self.fe_config.mask_config.min_mask_size_ratio,
+                    "max_mask_size_ratio": self.fe_config.mask_config.max_mask_size_ratio,
+                    "seed": self.global_params.random_state
+                }
+            trainer = ModelTrainer(config=self.config, hyperparams=hyperparams, online_mask_config=online_mask_config)
+
+            latent_cache_config = self.config.latent_cache
+            if latent_cache_config.enabled and online_masks:
+                # Masked latents depend on the mask, which now changes every epoch.
+                self.logger.warning("The latent cache is keyed on fixed (image, mask) pairs and is skipped when online masks are enabled.")
+            elif latent_cache_config.enabled:
+                # The VAE is frozen, so latents are encoded once up front instead of on every step.
+                train_dataset = trainer.build_latent_cache(
+                    train_dataset,
+                    cache_dir=Path(latent_cache_config.cache_dir) / "train",
+                    shard_size=latent_cache_config.shard_size,
+                    batch_size=latent_cache_config.encode_batch_size
+                )
+
+            # Packed shards are read shard by shard so I/O stays sequential within each file.
+            train_sampler = None
+            if getattr(train_dataset, "packed_reader", None) is not None:
+                train_sampler = ShardAwareSampler(train_dataset.packed_reader, seed=self.global_params.random_state)
 
             train_dataloader = DataLoader(
                 train_dataset,
                 batch_size=self.config.train_batch_size,
-                shuffle=True
+                shuffle=train_sampler is None,
+                sampler=train_sampler
             )
             val_dataloader = DataLoader(
                 val_dataset,
@@ -45,8 +92,7 @@ class ModelTrainingStage:
             )
             self.logger.info("Datasets and DataLoaders created.")
 
-            # --- Initialize and Run Trainer ---
-            trainer = ModelTrainer(config=self.config, hyperparams=hyperparams)
+            # --- Run Trainer ---
             final_unet = trainer.train(train_dataloader, val_dataloader)
 
             # --- Save Final Model ---
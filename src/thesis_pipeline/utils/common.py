@@ -1,11 +1,20 @@
 # src/thesis_pipeline/utils/common.py
+import os
+import csv
 import json
 import yaml
 import pickle
+import shutil
 import logging
+import threading
 from pathlib import Path
 from box import ConfigBox
 
+try:
+    import fcntl  # Not available on Windows; reflinks are then skipped
+except ImportError:
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 def save_json(path: Path, data: dict):
@@ -29,6 +38,20 @@ def load_json(path: Path) -> ConfigBox:
         logger.error(f"Error loading JSON file from {path}: {e}")
         raise
 
+def save_csv(path: Path, rows: list):
+    """Saves a list of dictionaries (one per row, same keys) to a CSV file, atomically."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else [])
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_path, path)
+        logger.info(f"CSV file saved successfully at: {path}")
+    except Exception as e:
+        logger.error(f"Error saving CSV file at {path}: {e}")
+        raise
+
 def save_yaml(path: Path, data: dict):
     """Saves a dictionary to a YAML file."""
     try:
@@ -82,3 +105,73 @@ def get_file_size(path: Path) -> str:
     except Exception as e:
         logger.error(f"Error getting file size for {path}: {e}")
         return "Size unavailable"
+
+# ioctl request that clones a file's extents into another (reflink), on Btrfs, XFS and similar
+FICLONE = 0x40049409
+
+def link_or_copy(source: Path, destination: Path) -> str:
+    """
+    Places `source` at `destination` without duplicating its data where the filesystem allows:
+    a hard link first, then a reflink (copy-on-write clone), then a regular copy.
+    An existing destination is replaced. Returns "hardlink", "reflink" or "copy".
+    """
+    destination.unlink(missing_ok=True)
+    try:
+        os.link(source, destination)
+        return "hardlink"
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(destination, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError:
+            destination.unlink(missing_ok=True)
+    shutil.copy(source, destination)
+    return "copy"
+
+class PersistentRecordStore:
+    """
+    Thread-safe dictionary of JSON records that is periodically flushed to disk.
+    """
+    def __init__(self, path: Path, flush_every: int = 25):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            logger.info(f"Loaded {len(entries)} records from: {self.path}")
+            return entries
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read {self.path}. Starting fresh. Error: {e}")
+            return {}
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def set(self, key: str, value):
+        with self._lock:
+            self.entries[key] = value
+            self._pending_writes += 1
+            if self._pending_writes >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        # Write to a temporary file first so a crash never leaves a truncated file behind.
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._pending_writes = 0
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+# The package lives in src/ and is not necessarily installed.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
@@ -0,0 +1,147 @@
+# tests/test_data_acquisition.py
+import io
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from thesis_pipeline.components.content_index import ContentIndex
+from thesis_pipeline.components.data_acquisition import DataAcquisition, DownloadManifest
+
+
+class _SlowResponse:
+    """Streams a body in small chunks with pauses, so concurrent downloads overlap."""
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), 256):
+            time.sleep(0.001)
+            yield self.body[start:start + 256]
+
+
+def _png_bytes(color: tuple) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_concurrent_downloads_with_colliding_names_keep_both_files(tmp_path):
+    # Different titles whose URLs sanitize to the same filename, with different content.
+    bodies = {f"https://upload.example/{folder}/Vase.png": _png_bytes(color)
+              for folder, color in [("a", (255, 0, 0)), ("b", (0, 255, 0)), ("c", (0, 0, 255))]}
+    downloader = DataAcquisition("https://api.example", max_workers=len(bodies))
+    downloader._get_with_retry = lambda url, **kwargs: _SlowResponse(bodies[url])
+    manifest = DownloadManifest(tmp_path / "download_manifest.json")
+    content_index = ContentIndex(tmp_path / "content_index.json")
+
+    start = threading.Barrier(len(bodies))
+    def download(url):
+        start.wait()
+        info = {"url": url, "sha1": hashlib.sha1(bodies[url]).hexdigest()}
+        return downloader._download_image(f"File:{url}", info, tmp_path, manifest, content_index)
+
+    with ThreadPoolExecutor(max_workers=len(bodies)) as executor:
+        outcomes = list(executor.map(download, bodies))
+
+    assert outcomes == ["downloaded"] * len(bodies)
+    stored = {entry["sha1"]: name for name, entry in content_index.entries.items()}
+    assert len(stored) == len(bodies)
+    for url, body in bodies.items():
+        assert (tmp_path / stored[hashlib.sha1(body).hexdigest()]).read_bytes() == body
+    assert not list(tmp_path.glob("*.part"))
+
+
+class _StubWikiHandler(BaseHTTPRequestHandler):
+    """
+    A MediaWiki API with one category of two files. The first request for each file is answered
+    with 429 and Retry-After; later ones with the file.
+    """
+    files = {"Vase_A.png": _png_bytes((200, 30, 30)), "Vase_B.png": _png_bytes((30, 30, 200))}
+    requests_log = []
+    throttled = set()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        type(self).requests_log.append((time.monotonic(), url.path))
+        if url.path == "/api.php":
+            params = parse_qs(url.query)
+            if params.get("list") == ["categorymembers"]:
+                members = [{"ns": 6, "title": f"File:{name}"} for name in self.files]
+                data = {"query": {"categorymembers": members}}
+            else:
+                host = f"http://{self.headers['Host']}"
+                pages = {
+                    str(i): {"title": title, "imageinfo": [{
+                        "url": f"{host}/files/{title[len('File:'):]}",
+                        "size": len(self.files[title[len('File:'):]]),
+                        "sha1": hashlib.sha1(self.files[title[len('File:'):]]).hexdigest(),
+                    }]}
+                    for i, title in enumerate(params["titles"][0].split("|"))
+                }
+                data = {"query": {"pages": pages}}
+            self._send(200, json.dumps(data).encode("utf-8"), "application/json")
+        elif url.path.startswith("/files/"):
+            name = url.path[len("/files/"):]
+            if name not in self.throttled:
+                type(self).throttled.add(name)
+                self._send(429, b"slow down", "text/plain", {"Retry-After": "1"})
+            else:
+                self._send(200, self.files[name], "image/png")
+        else:
+            self._send(404, b"", "text/plain")
+
+
+def test_downloader_retries_rate_limits_and_resumes_against_a_stub_server(tmp_path):
+    _StubWikiHandler.requests_log.clear()
+    _StubWikiHandler.throttled.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubWikiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/api.php"
+    requests_per_second = 20.0
+    try:
+        downloader = DataAcquisition(api_url, max_workers=4, requests_per_second=requests_per_second,
+                                     max_retries=3, backoff_factor=0.01, timeout=5.0)
+        downloader.download_images_from_category("Category:Vases", tmp_path, limit=10)
+
+        log = list(_StubWikiHandler.requests_log)
+        for name, body in _StubWikiHandler.files.items():
+            assert (tmp_path / name).read_bytes() == body
+            # Throttled once, then retried no sooner than Retry-After allowed.
+            file_requests = [t for t, path in log if path == f"/files/{name}"]
+            assert len(file_requests) == 2
+            assert file_requests[1] - file_requests[0] >= 0.95
+        # Requests to the host were spaced out by the rate limiter (with slack for network jitter).
+        times = sorted(t for t, _ in log)
+        assert min(b - a for a, b in zip(times, times[1:])) >= 0.5 / requests_per_second
+
+        # A second run only crawls the category: every title is complete in the manifest.
+        _StubWikiHandler.requests_log.clear()
+        DataAcquisition(api_url, requests_per_second=requests_per_second).download_images_from_category(
+            "Category:Vases", tmp_path, limit=10
+        )
+        assert [path for _, path in _StubWikiHandler.requests_log] == ["/api.php"]
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,31 @@
+# tests/test_dataset.py
+import os
+import numpy as np
+from PIL import Image
+from thesis_pipeline.components.dataset import InpaintingDataset
+
+
+def _write_split(data_dir, split_name, color):
+    for subdir in ("ground_truth", "masks"):
+        (data_dir / split_name / subdir).mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (32, 32), color).save(data_dir / split_name / "ground_truth" / "a.png")
+    mask = np.zeros((32, 32), dtype=np.uint8)
+    mask[8:16, 8:16] = 255
+    Image.fromarray(mask).save(data_dir / split_name / "masks" / "a.png")
+
+
+def test_decoded_cache_is_rebuilt_when_a_source_image_changes(tmp_path):
+    data_dir, cache_dir = tmp_path / "data", tmp_path / "cache"
+    _write_split(data_dir, "train", (255, 0, 0))
+    first = InpaintingDataset(data_dir, [16, 16], "train", cache_dir=cache_dir)
+    assert first[0]["original_image"][0].mean().item() == 1.0
+
+    # Regenerate the image under the same name, with an mtime that differs from the original's.
+    image_path = data_dir / "train" / "ground_truth" / "a.png"
+    Image.new("RGB", (32, 32), (0, 0, 255)).save(image_path)
+    stat = image_path.stat()
+    os.utime(image_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    second = InpaintingDataset(data_dir, [16, 16], "train", cache_dir=cache_dir)
+    sample = second[0]["original_image"]
+    assert sample[0].mean().item() == -1.0 and sample[2].mean().item() == 1.0
@@ -0,0 +1,41 @@
+# tests/test_feature_engineering.py
+import csv
+import numpy as np
+import yaml
+from PIL import Image
+from thesis_pipeline.config_manager import ConfigManager
+from thesis_pipeline.components.splitting import SPLIT_MANIFEST_FILENAME
+from thesis_pipeline.components.masking import INPAINTING_MANIFEST_FILENAME
+from thesis_pipeline.pipeline.stage_05_feature_engineering import FeatureEngineeringStage
+
+
+def test_stage_05_uses_the_configured_image_format(tmp_path):
+    with open("config/smoke_test_config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    split_dir, dataset_dir = tmp_path / "splits", tmp_path / "inpainting"
+    config["data_processing"]["format"] = "JPEG"
+    config["data_paths"].update(split_data=str(split_dir), inpainting_dataset=str(dataset_dir),
+                                metadata_store=str(tmp_path / "metadata.sqlite"))
+    config["feature_engineering"]["output_format"] = "files"
+
+    split_dir.mkdir()
+    rows = []
+    for i, split in enumerate(["train", "train", "validation", "test"]):
+        path = split_dir / f"img{i}.jpeg"
+        Image.fromarray(np.full((40, 48, 3), 60 * i, dtype=np.uint8)).save(path, format="JPEG")
+        rows.append({"path": str(path), "split": split})
+    rows.append({"path": str(split_dir / "notes.txt"), "split": "train"})
+    with open(split_dir / SPLIT_MANIFEST_FILENAME, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["path", "split"])
+        writer.writeheader()
+        writer.writerows(rows)
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+
+    FeatureEngineeringStage(ConfigManager(config_path)).run()
+
+    with open(dataset_dir / INPAINTING_MANIFEST_FILENAME, "r", encoding="utf-8", newline="") as f:
+        written = list(csv.DictReader(f))
+    assert sorted(row["filename"] for row in written) == ["img0.jpeg", "img1.jpeg", "img2.jpeg", "img3.jpeg"]
+    with Image.open(dataset_dir / written[0]["mask"]) as mask:
+        assert mask.format == "PNG" and set(np.unique(np.asarray(mask))) <= {0, 255}
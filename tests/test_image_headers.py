@@ -0,0 +1,23 @@
+# tests/test_image_headers.py
+import io
+import pytest
+from PIL import Image
+from thesis_pipeline.components.image_headers import read_image_header, read_image_size
+
+
+def test_truncated_jpeg_headers_do_not_raise(tmp_path):
+    buffer = io.BytesIO()
+    Image.new("RGB", (30, 20)).save(buffer, format="JPEG")
+    data = buffer.getvalue()
+    assert read_image_header(_write(tmp_path / "full.jpg", data)) == (30, 20, "RGB")
+
+    # Cut inside the segment walk: the parser gives up and PIL reports the broken file.
+    sof = data.index(b"\xff\xc0")
+    for cut in (3, 5, sof + 3, sof + 6):
+        with pytest.raises(OSError):
+            read_image_size(_write(tmp_path / f"cut_{cut}.jpg", data[:cut]))
+
+
+def _write(path, data: bytes):
+    path.write_bytes(data)
+    return path
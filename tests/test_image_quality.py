@@ -0,0 +1,39 @@
+# tests/test_image_quality.py
+import numpy as np
+import pandas as pd
+from PIL import Image
+from thesis_pipeline.components.image_quality import (
+    QUALITY_COLUMNS, BLOCKINESS_CROP, _centre_crop_blockiness, batch_quality_stats, load_thumbnail, quality_flags
+)
+
+THRESHOLDS = {"min_laplacian_variance": 0.0, "max_blockiness": 10.0, "max_background_fraction": 1.0, "min_luma_std": 8.0}
+
+
+def test_low_contrast_uses_the_std_of_luma():
+    # Red and green stripes of almost equal luma: each channel varies strongly, the luma barely does.
+    thumbnail = np.zeros((1, 16, 16, 3), dtype=np.uint8)
+    thumbnail[0, :, ::2] = (200, 0, 0)
+    thumbnail[0, :, 1::2] = (0, 102, 0)
+    stats = pd.DataFrame(batch_quality_stats(thumbnail, background_tolerance=0))
+    assert stats["std_r"][0] > 50 and stats["std_luma"][0] < 1
+    assert set(stats.columns) == set(QUALITY_COLUMNS) - {"blockiness"}
+    stats["blockiness"] = 1.0
+    assert quality_flags(stats, THRESHOLDS)[0] == "low_contrast"
+
+
+def test_large_jpeg_thumbnail_is_draft_decoded_but_blockiness_is_full_resolution(tmp_path):
+    rng = np.random.default_rng(0)
+    pixels = np.asarray(Image.fromarray(rng.integers(0, 256, (150, 200, 3), dtype=np.uint8)).resize((1600, 1200)))
+    path = tmp_path / "blocky.jpg"
+    Image.fromarray(pixels).save(path, quality=10)
+
+    thumbnail, blockiness = load_thumbnail(path, 64)
+
+    with Image.open(path) as img:
+        full = img.convert("RGB")
+    reference = np.asarray(full.resize((64, 64), Image.BILINEAR, reducing_gap=2.0), dtype=np.float32)
+    assert thumbnail.shape == (64, 64, 3)
+    assert np.abs(thumbnail.astype(np.float32) - reference).mean() < 4
+    assert abs(blockiness - _centre_crop_blockiness(full.convert("L"))) < 0.05
+    assert blockiness > 1.5
+    assert min(full.size) > BLOCKINESS_CROP
@@ -0,0 +1,57 @@
+# tests/test_latent_cache.py
+import os
+from types import SimpleNamespace
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from thesis_pipeline.components.dataset import InpaintingDataset
+from thesis_pipeline.components.latent_cache import LatentCache
+
+
+class _FakeVAE:
+    """Stands in for AutoencoderKL: the latent mean is the image average-pooled 4x."""
+    dtype = torch.float32
+
+    def encode(self, images):
+        mean = F.avg_pool2d(images, 4)
+        return SimpleNamespace(latent_dist=SimpleNamespace(mean=mean, logvar=torch.zeros_like(mean)))
+
+
+class _CountingDataset(InpaintingDataset):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decoded = 0
+
+    def __getitem__(self, idx):
+        self.decoded += 1
+        return super().__getitem__(idx)
+
+
+def _write_sample(data_dir, name, color):
+    for subdir in ("ground_truth", "masks"):
+        (data_dir / "train" / subdir).mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (16, 16), color).save(data_dir / "train" / "ground_truth" / name)
+    Image.new("L", (16, 16), 0).save(data_dir / "train" / "masks" / name)
+
+
+def test_warm_cache_skips_decoding_and_changed_sources_rebuild(tmp_path):
+    data_dir, cache_dir = tmp_path / "data", tmp_path / "latents"
+    _write_sample(data_dir, "a.png", (255, 255, 255))
+    _write_sample(data_dir, "b.png", (0, 0, 0))
+    cache = LatentCache(cache_dir, shard_size=8)
+
+    cached = cache.build(_FakeVAE(), _CountingDataset(data_dir, [16, 16], "train"), batch_size=2, device="cpu")
+    assert np.allclose(cached[0]["latent_mean"], 1.0)
+
+    warm = _CountingDataset(data_dir, [16, 16], "train")
+    cache.build(_FakeVAE(), warm, batch_size=2, device="cpu")
+    assert warm.decoded == 0
+
+    # Regenerate a.png under the same name; its latents must be recomputed.
+    image_path = data_dir / "train" / "ground_truth" / "a.png"
+    Image.new("RGB", (16, 16), (0, 0, 0)).save(image_path)
+    stat = image_path.stat()
+    os.utime(image_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    rebuilt = cache.build(_FakeVAE(), _CountingDataset(data_dir, [16, 16], "train"), batch_size=2, device="cpu")
+    assert np.allclose(rebuilt[0]["latent_mean"], -1.0)
@@ -0,0 +1,112 @@
+# tests/test_model_evaluation.py
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from box import ConfigBox
+from PIL import Image
+from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionInpaintPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+from thesis_pipeline.components.model_evaluation import ModelEvaluator
+
+NUM_SAMPLES = 5
+
+
+@pytest.fixture(scope="module")
+def tiny_setup(tmp_path_factory):
+    """A tiny randomly initialized inpainting pipeline, its UNet as the trained model, and a test set."""
+    root = tmp_path_factory.mktemp("tiny")
+    torch.manual_seed(0)
+    vae = AutoencoderKL(block_out_channels=(8, 16), down_block_types=("DownEncoderBlock2D",) * 2,
+                        up_block_types=("UpDecoderBlock2D",) * 2, latent_channels=4, norm_num_groups=4)
+    unet = UNet2DConditionModel(sample_size=16, in_channels=9, out_channels=4, block_out_channels=(8, 16),
+                                down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+                                up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"), cross_attention_dim=16,
+                                layers_per_block=1, norm_num_groups=4, attention_head_dim=2)
+    text_encoder = CLIPTextModel(CLIPTextConfig(hidden_size=16, intermediate_size=32, num_attention_heads=2,
+                                                num_hidden_layers=1, vocab_size=100, max_position_embeddings=77))
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1, **{f"{c}</w>": 2 + i for i, c in enumerate("abcdefghij")}}
+    (root / "vocab.json").write_text(json.dumps(vocab))
+    (root / "merges.txt").write_text("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(str(root / "vocab.json"), str(root / "merges.txt"), model_max_length=77)
+    StableDiffusionInpaintPipeline(
+        vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, unet=unet,
+        scheduler=PNDMScheduler(skip_prk_steps=True, steps_offset=1), safety_checker=None, feature_extractor=None,
+        requires_safety_checker=False,
+    ).save_pretrained(root / "base")
+    unet.save_pretrained(root / "trained" / "unet_final")
+
+    rng = np.random.default_rng(0)
+    for subdir in ("ground_truth", "masks"):
+        (root / "test" / subdir).mkdir(parents=True)
+    for i in range(NUM_SAMPLES):
+        Image.fromarray(rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)).save(root / "test" / "ground_truth" / f"{i}.png")
+        mask = np.zeros((32, 32), dtype=np.uint8)
+        mask[8:24, 4 + i:20 + i] = 255
+        Image.fromarray(mask).save(root / "test" / "masks" / f"{i}.png")
+    return root
+
+
+def make_evaluator(root, output_dir, **overrides) -> ModelEvaluator:
+    config = {
+        "base_model_id": str(root / "base"), "device": "cpu", "trained_model_dir": str(root / "trained"),
+        "output_dir": str(output_dir), "num_inference_steps": 2, "num_samples_to_evaluate": 0, "batch_size": 1,
+        **overrides,
+    }
+    return ModelEvaluator(ConfigBox(config), root / "test")
+
+
+def test_batched_inpainting_matches_unbatched(tiny_setup, tmp_path):
+    evaluator = make_evaluator(tiny_setup, tmp_path)
+    pipeline = evaluator._load_pipeline(tiny_setup / "trained" / "unet_final")
+    samples = evaluator._find_samples()
+    images = [Image.open(img_path).convert("RGB") for img_path, _ in samples]
+    masks = [Image.open(mask_path).convert("RGB") for _, mask_path in samples]
+    seeds = list(range(len(samples)))
+
+    batched = evaluator._inpaint(pipeline, images, masks, seeds)
+    single = [evaluator._inpaint(pipeline, [image], [mask], [seed])[0] for image, mask, seed in zip(images, masks, seeds)]
+
+    for batched_image, single_image in zip(batched, single):
+        assert np.abs(np.asarray(batched_image, dtype=np.int16) - np.asarray(single_image, dtype=np.int16)).max() == 0
+
+
+def test_evaluation_reports_throughput_independent_of_batch_size(tiny_setup, tmp_path):
+    make_evaluator(tiny_setup, tmp_path / "batch1", batch_size=1).evaluate()
+    make_evaluator(tiny_setup, tmp_path / "batch3", batch_size=3).evaluate()
+
+    batch1 = pd.read_csv(tmp_path / "batch1" / "evaluation_metrics.csv")
+    batch3 = pd.read_csv(tmp_path / "batch3" / "evaluation_metrics.csv")
+    assert len(batch1) == NUM_SAMPLES and list(batch1["filename"]) == list(batch3["filename"])
+    assert np.allclose(batch1["psnr"], batch3["psnr"], atol=0.05)
+    assert "Throughput:" in (tmp_path / "batch3" / "summary_report.txt").read_text()
+
+
+def test_stale_shards_are_re_evaluated(tiny_setup, tmp_path):
+    output_dir = tmp_path / "eval"
+    make_evaluator(tiny_setup, output_dir, num_inference_steps=2).evaluate()
+    first = pd.read_csv(output_dir / "evaluation_metrics.csv")
+
+    # A re-run with the same fingerprint reuses the completed shard.
+    done_marker = output_dir / "shards" / "shard_000_of_001.done.json"
+    marker_mtime = done_marker.stat().st_mtime_ns
+    make_evaluator(tiny_setup, output_dir, num_inference_steps=2).evaluate()
+    assert done_marker.stat().st_mtime_ns == marker_mtime
+
+    # Changed settings and fewer samples invalidate it.
+    make_evaluator(tiny_setup, output_dir, num_inference_steps=3, num_samples_to_evaluate=3).evaluate()
+    changed = pd.read_csv(output_dir / "evaluation_metrics.csv")
+    assert len(changed) == 3 and not np.allclose(changed["psnr"], first["psnr"][:3])
+
+    # So do new weights under the same checkpoint name, e.g. after retraining.
+    retrained_root = tmp_path / "retrained"
+    unet = UNet2DConditionModel.from_pretrained(tiny_setup / "trained" / "unet_final")
+    with torch.no_grad():
+        for parameter in unet.parameters():
+            parameter.mul_(1.5)
+    unet.save_pretrained(retrained_root / "unet_final")
+    make_evaluator(tiny_setup, output_dir, num_inference_steps=3, num_samples_to_evaluate=3,
+                   trained_model_dir=str(retrained_root)).evaluate()
+    retrained = pd.read_csv(output_dir / "evaluation_metrics.csv")
+    assert not np.allclose(retrained["psnr"], changed["psnr"])
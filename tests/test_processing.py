@@ -0,0 +1,19 @@
+# tests/test_processing.py
+import numpy as np
+import pytest
+from PIL import Image
+from thesis_pipeline.components.processing import _process_single_image
+
+
+@pytest.mark.parametrize("mode", ["P", "1", "I;16"])
+def test_fast_decode_handles_modes_without_reduce(tmp_path, mode):
+    source = tmp_path / f"large_{mode.replace(';', '')}.png"
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (2000, 2000, 3), dtype=np.uint8)).convert(mode).save(source)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+
+    _, error, sha1 = _process_single_image(source, output_dir, (256, 256), "PNG", fast_decode=True)
+
+    assert error is None and sha1 is not None
+    with Image.open(output_dir / f"{source.stem}.png") as result:
+        assert result.size == (256, 256) and result.mode == "RGB"
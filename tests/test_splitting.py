@@ -0,0 +1,12 @@
+# tests/test_splitting.py
+import pytest
+from thesis_pipeline.components.splitting import DataSplitter
+
+
+def test_unknown_stratify_by_column_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="aspect_ration"):
+        DataSplitter(tmp_path, tmp_path / "out", 0.1, 0.1, 42, split_strategy="stratified_group",
+                     stratify_by=["mode", "aspect_ration"])
+    splitter = DataSplitter(tmp_path, tmp_path / "out", 0.1, 0.1, 42, split_strategy="stratified_group",
+                            stratify_by=["aspect_ratio", "mode", "pixel_count", "laplacian_variance"])
+    assert splitter.stratify_by == ["aspect_ratio", "mode", "pixel_count", "laplacian_variance"]